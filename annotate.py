@@ -0,0 +1,244 @@
+"""
+Annotate the games in PGN files with the chess AI's evaluation and best moves
+"""
+import argparse
+import collections
+import concurrent.futures
+import io
+import json
+import multiprocessing
+import os
+import time
+
+# niklasf/python-chess is licensed under GPL-3.0
+import chess
+import chess.engine
+import chess.pgn
+
+import chess50
+import pgnfile
+import worker
+
+# Milliseconds searched in each position when no depth is given
+MOVETIME = 200
+
+# Centipawns a move may lose against the best move before it is marked
+# as an inaccuracy, a mistake or a blunder
+INACCURACY = 50
+MISTAKE = 100
+BLUNDER = 300
+
+# Games sent to the worker processes ahead of the one being written
+GAMES_AHEAD = 2
+
+# Centipawns that checkmates and tablebase wins count as in the values
+# written and the loss of each move, so a missed mate is a blunder
+# rather than a loss of a million centipawns
+MATE_VALUE = 10000
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('pgn', nargs='+', help="PGN files to annotate")
+    parser.add_argument('--output', default='annotated.pgn', help="PGN file to write the annotated games to")
+    parser.add_argument('--jsonl', help="file to write the evaluation of each game to as a line of JSON")
+    parser.add_argument('--resume', action='store_true', help="skip the games already in the output files")
+    parser.add_argument('--movetime', type=int, default=MOVETIME, help="milliseconds per position")
+    parser.add_argument('--depth', type=int, help="depth per position instead of a time")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of search processes")
+    parser.add_argument('--table-mb', type=int, default=chess50.TABLE_SIZE_MB, help="size of the shared hash table")
+    parser.add_argument('--cache', help="SQLite file of search results shared by the workers and kept between runs")
+    parser.add_argument('--engine', default='{}', help="ChessAI options of the workers as JSON")
+    args = parser.parse_args()
+
+    if args.depth is not None and args.depth < 1:
+        parser.error("the depth must be at least 1")
+    movetime = None if args.depth else args.movetime
+    depth = min(args.depth or chess50.MAX_SEARCH_DEPTH, chess50.MAX_SEARCH_DEPTH)
+
+    # Each output may hold a different number of games if the last run
+    # stopped between writing one and the other
+    written_pgn = count_games(args.output) if args.resume else 0
+    written_jsonl = count_lines(args.jsonl) if args.resume and args.jsonl else 0
+    skip = min(written_pgn, written_jsonl) if args.jsonl else written_pgn
+    if skip:
+        print(f"Resuming after {skip} games")
+
+    started = time.monotonic()
+    games = positions = 0
+
+    pgn_file = open(args.output, 'a' if args.resume else 'w')
+    jsonl_file = open(args.jsonl, 'a' if args.resume else 'w') if args.jsonl else None
+    try:
+        for index, pgn, record in annotate(
+            args.pgn, skip, movetime, depth, args.workers, args.table_mb, args.cache, json.loads(args.engine)
+        ):
+            if index >= written_pgn:
+                print(pgn, end='\n\n', file=pgn_file, flush=True)
+            if jsonl_file and index >= written_jsonl:
+                print(json.dumps(record), file=jsonl_file, flush=True)
+
+            games += 1
+            positions += len(record['moves'])
+            elapsed = time.monotonic() - started
+            print(
+                f"Game {index + 1}: {len(record['moves'])} moves, "
+                f"{games / elapsed:.2f} games/s, {positions / elapsed:.1f} positions/s",
+                flush=True
+            )
+    except KeyboardInterrupt:
+        print(f"Stopped after {skip + games} games; run again with --resume to continue")
+    finally:
+        pgn_file.close()
+        if jsonl_file:
+            jsonl_file.close()
+
+
+def annotate(paths, skip, movetime, depth, workers, table_mb, cache, options):
+    """
+    Annotates the games in some PGN files after the first skip of them
+    in worker processes, generating the index, annotated PGN and JSON
+    record of each game in the order they were read
+
+    Only a few games are read ahead of the workers, so memory does not
+    grow with the size of the files
+    """
+    pending = collections.deque()
+    buffer = multiprocessing.RawArray('B', 16 * chess50.table_slots(table_mb))
+
+    with concurrent.futures.ProcessPoolExecutor(
+        workers,
+        initializer=worker.start_worker,
+        initargs=(buffer, table_mb, {**options, 'cache': cache})
+    ) as pool:
+        try:
+            for index, text in enumerate(pgnfile.read_games(paths)):
+                if index < skip:
+                    continue
+                pending.append((index, pool.submit(annotate_game, text, movetime, depth)))
+                if len(pending) >= workers * GAMES_AHEAD:
+                    index, future = pending.popleft()
+                    yield (index, *future.result())
+            while pending:
+                index, future = pending.popleft()
+                yield (index, *future.result())
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def count_games(path):
+    """
+    Returns the number of games in a PGN file, or 0 if there is no such file
+    """
+    if not os.path.exists(path):
+        return 0
+
+    games = 0
+    with open(path, errors='replace') as file:
+        while chess.pgn.read_headers(file) is not None:
+            games += 1
+    return games
+
+
+def count_lines(path):
+    """
+    Returns the number of complete lines in a file, or 0 if there is no such file
+    """
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, 'rb') as file:
+        return sum(1 for line in file if line.endswith(b'\n'))
+
+
+def annotate_game(text, movetime, depth):
+    """
+    Searches every position of a game in a worker process, returning the
+    game as PGN with the value after each move, the best move where another
+    move was played and a mark on moves that lost value, and a record of
+    the value, moves to checkmate, best move, depth and nodes of each position
+    """
+    game = chess.pgn.read_game(io.StringIO(text))
+    if game is None:
+        return '', {'headers': {}, 'moves': []}
+
+    # The position after the last move is searched too, for the value of that move
+    board = game.board()
+    nodes = list(game.mainline())
+    searches = [search_position(board, movetime, depth)]
+    for node in nodes:
+        board.push(node.move)
+        searches.append(search_position(board, movetime, depth))
+
+    moves = []
+    for node, before, after in zip(nodes, searches, searches[1:]):
+        board = node.parent.board()
+        node.set_eval(after['score'], after['depth'] or None)
+
+        loss = before['value'] - after['value'] if board.turn == chess.WHITE else after['value'] - before['value']
+        best = before['move']
+        if best is not None and best != node.move:
+            if loss >= BLUNDER:
+                node.nags.add(chess.pgn.NAG_BLUNDER)
+            elif loss >= MISTAKE:
+                node.nags.add(chess.pgn.NAG_MISTAKE)
+            elif loss >= INACCURACY:
+                node.nags.add(chess.pgn.NAG_DUBIOUS_MOVE)
+            if loss >= INACCURACY:
+                node.parent.add_variation(best)
+
+        moves.append({
+            'ply': board.ply(),
+            'move': node.move.uci(),
+            'san': node.san(),
+            'value': after['value'],
+            'mate': after['mate'],
+            'best': best.uci() if best else None,
+            'loss': max(0, loss),
+            'depth': before['depth'],
+            'nodes': before['nodes'],
+        })
+
+    exporter = chess.pgn.StringExporter(headers=True, variations=True, comments=True)
+    return game.accept(exporter), {
+        'headers': dict(game.headers),
+        'value': searches[0]['value'],
+        'mate': searches[0]['mate'],
+        'moves': moves,
+    }
+
+
+def search_position(board, movetime, depth):
+    """
+    Returns the value of a position from White's point of view, capped
+    at MATE_VALUE, the moves to checkmate from White's point of view if
+    it is one, its score for the PGN, its best move and the depth and
+    nodes of the search, with the game's moves so far known to the search
+    for repetitions
+    """
+    info = {'depth': 0, 'pv': []}
+    ai = worker.worker_ai
+    value, move = ai.search(board, movetime=movetime, depth=depth, callback=info.update)
+
+    mate = chess50.mate_in(board, value if board.turn == chess.WHITE else -value, info['pv'], info['depth'])
+    value = max(-MATE_VALUE, min(MATE_VALUE, value))
+    if mate is None:
+        score = chess.engine.PovScore(chess.engine.Cp(value), chess.WHITE)
+    else:
+        score = chess.engine.PovScore(chess.engine.Mate(mate), board.turn)
+        mate = mate if board.turn == chess.WHITE else -mate
+
+    return {
+        'value': value,
+        'mate': mate,
+        'score': score,
+        'move': move,
+        'depth': info['depth'],
+        'nodes': ai.nodes,
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark the chess AI's search, evaluation and hashing
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+# niklasf/python-chess is licensed under GPL-3.0
+import chess
+
+import chess50
+
+# Positions searched by the benchmark and the depth each is searched to
+POSITIONS = [
+    ('opening', chess.STARTING_FEN, 5),
+    ('opening', 'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3', 5),
+    ('middlegame', 'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2QKB1R w KQ - 0 8', 4),
+    ('middlegame', 'r2q1rk1/1b2bppp/p1n1pn2/1p6/3P4/P1NBPN2/1P3PPP/R1BQ1RK1 w - - 0 12', 4),
+    ('tactical', '5rk1/1ppb3p/p1pb4/6q1/3P1p1r/2P1R2P/PP1BQ1P1/5RKN w - - 0 1', 6),
+    ('tactical', 'r1b1k2r/ppppnppp/2n2q2/2b5/3NP3/2P1B3/PP3PPP/RN1QKB1R w KQkq - 0 7', 4),
+    ('endgame', '8/pp3k2/2p1p1p1/2P5/1P1P4/4K3/P5PP/8 w - - 0 1', 8),
+    ('endgame', '8/8/4k3/3r4/8/3K4/3R4/8 w - - 0 1', 5),
+]
+
+# Number of calls timed for the evaluation and hashing benchmarks
+CALLS = 20000
+
+# Relative drop in speed reported as a regression
+TOLERANCE = 0.1
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', help="file to write the results to as JSON")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="relative slowdown treated as a regression")
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'positions': [bench_search(name, fen, depth) for name, fen, depth in POSITIONS],
+        'utility': bench_calls('utility'),
+        'zobrist_hash': bench_calls('zobrist_hash'),
+    }
+
+    totals = totals_of(results)
+    results['totals'] = totals
+
+    print(f"{'Position':<12}{'Depth':>6}{'Time':>9}{'Nodes':>10}{'NPS':>9}{'EBF':>7}{'TT hits':>9}  Move")
+    for position in results['positions']:
+        print(
+            f"{position['name']:<12}{position['depth']:>6}{position['time']:>9.3f}"
+            f"{position['nodes']:>10}{position['nps']:>9}{position['ebf']:>7.2f}"
+            f"{position['tt_hit_rate']:>9.1%}  {position['move']}"
+        )
+    print(
+        f"{'Total':<12}{'':>6}{totals['time']:>9.3f}{totals['nodes']:>10}{totals['nps']:>9}"
+    )
+    print(f"utility: {results['utility']:.2f} us per call")
+    print(f"zobrist_hash: {results['zobrist_hash']:.2f} us per call")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if regressions := compare(baseline, results, args.tolerance):
+            for regression in regressions:
+                print(regression, file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+def bench_search(name, fen, depth):
+    """
+    Searches a position to a fixed depth with an empty transposition table,
+    returning the time, node count, nodes per second, effective branching
+    factor and transposition table hit rate of the search
+    """
+    ai = chess50.ChessAI()
+    board = chess.Board(fen)
+
+    # Nodes searched by each iteration
+    iterations = []
+    callback = lambda info: iterations.append(info['nodes'] - sum(iterations))
+
+    started = time.perf_counter()
+    value, move = ai.search(board, depth=depth, callback=callback)
+    elapsed = time.perf_counter() - started
+
+    stats = ai.table.stats()
+    return {
+        'name': name,
+        'fen': fen,
+        'depth': len(iterations),
+        'move': move.uci() if move else None,
+        'value': value,
+        'time': elapsed,
+        'nodes': ai.nodes,
+        'nps': int(ai.nodes / elapsed),
+        'ebf': iterations[-1] / iterations[-2] if len(iterations) > 1 and iterations[-2] else 0,
+        'tt_hit_rate': stats['hit_rate'],
+    }
+
+
+def bench_calls(method):
+    """
+    Returns the average time in microseconds of a ChessAI method
+    called on the benchmark positions
+    """
+    ai = chess50.ChessAI()
+    boards = [chess.Board(fen) for _, fen, _ in POSITIONS]
+    function = getattr(ai, method)
+
+    started = time.perf_counter()
+    for i in range(CALLS):
+        function(boards[i % len(boards)])
+    return (time.perf_counter() - started) / CALLS * 10 ** 6
+
+
+def totals_of(results):
+    """
+    Returns the total time and nodes of the searches of a run
+    """
+    time = sum(position['time'] for position in results['positions'])
+    nodes = sum(position['nodes'] for position in results['positions'])
+    return {'time': time, 'nodes': nodes, 'nps': int(nodes / time)}
+
+
+def compare(baseline, results, tolerance):
+    """
+    Returns descriptions of the ways the results are worse than the baseline
+    """
+    regressions = []
+
+    if results['totals']['nps'] < baseline['totals']['nps'] * (1 - tolerance):
+        regressions.append(
+            f"Search speed fell from {baseline['totals']['nps']} to {results['totals']['nps']} nodes per second"
+        )
+    if results['totals']['time'] > baseline['totals']['time'] * (1 + tolerance):
+        regressions.append(
+            f"Search time rose from {baseline['totals']['time']:.3f} to {results['totals']['time']:.3f} seconds"
+        )
+
+    for method in ('utility', 'zobrist_hash'):
+        if results[method] > baseline[method] * (1 + tolerance):
+            regressions.append(
+                f"{method} slowed from {baseline[method]:.2f} to {results[method]:.2f} us per call"
+            )
+
+    # The searches are deterministic, so any difference in nodes means
+    # the search itself changed
+    for old, new in zip(baseline['positions'], results['positions']):
+        if old['fen'] == new['fen'] and old['depth'] == new['depth'] and old['nodes'] != new['nodes']:
+            print(
+                f"Note: {new['name']} {new['fen']} searched {new['nodes']} nodes instead of {old['nodes']}",
+                file=sys.stderr
+            )
+
+    return regressions
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Build a Polyglot opening book for the chess AI from PGN files
+"""
+import argparse
+import collections
+import struct
+
+# niklasf/python-chess is licensed under GPL-3.0
+import chess
+import chess.pgn
+import chess.polyglot
+
+# Moves of each game added to the book
+BOOK_PLIES = 20
+
+# Fewest games a move must have been played in to be added to the book
+MIN_GAMES = 2
+
+# Polyglot's code for each promotion piece
+PROMOTION_CODE = {
+    None: 0,
+    chess.KNIGHT: 1,
+    chess.BISHOP: 2,
+    chess.ROOK: 3,
+    chess.QUEEN: 4,
+}
+
+# Points of the player making a move for each result
+POINTS = {
+    ('1-0', chess.WHITE): 2,
+    ('0-1', chess.BLACK): 2,
+    ('1/2-1/2', chess.WHITE): 1,
+    ('1/2-1/2', chess.BLACK): 1,
+}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('pgn', nargs='+', help="PGN files to read")
+    parser.add_argument('--output', default='book.bin', help="file to write the book to")
+    parser.add_argument('--plies', type=int, default=BOOK_PLIES, help="moves of each game to add")
+    parser.add_argument('--min-games', type=int, default=MIN_GAMES, help="fewest games a move must appear in")
+    args = parser.parse_args()
+
+    games, weights = count_moves(args.pgn, args.plies, args.min_games)
+    entries = write_book(args.output, weights)
+    print(f"Wrote {entries} moves from {games} games to {args.output}")
+
+
+def count_moves(paths, plies, min_games):
+    """
+    Reads the games in some PGN files one at a time, returning the number
+    of games and the weight of every (hash, move code) played in at least
+    min_games of them, which is two points for each win and one for each
+    draw of the player making the move
+    """
+    counts = collections.Counter()
+    points = collections.Counter()
+    games = 0
+
+    for path in paths:
+        with open(path, errors='replace') as file:
+            while game := chess.pgn.read_game(file):
+                games += 1
+                result = game.headers.get('Result', '*')
+
+                board = game.board()
+                for move in game.mainline_moves():
+                    if board.ply() >= plies:
+                        break
+                    entry = chess.polyglot.zobrist_hash(board), move_code(board, move)
+                    counts[entry] += 1
+                    points[entry] += POINTS.get((result, board.turn), 0)
+                    board.push(move)
+
+    # Moves that never scored still get the smallest weight
+    return games, {
+        entry: max(1, points[entry])
+        for entry, count in counts.items()
+        if count >= min_games
+    }
+
+
+def move_code(board, move):
+    """
+    Encodes a move the way Polyglot books do, with castling
+    written as the king capturing its own rook
+    """
+    to_square = move.to_square
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        file = 7 if chess.square_file(move.to_square) > chess.square_file(move.from_square) else 0
+        to_square = chess.square(file, rank)
+
+    return (
+        chess.square_file(to_square) |
+        chess.square_rank(to_square) << 3 |
+        chess.square_file(move.from_square) << 6 |
+        chess.square_rank(move.from_square) << 9 |
+        PROMOTION_CODE[move.promotion] << 12
+    )
+
+
+def write_book(path, weights):
+    """
+    Writes book entries sorted by hash, as Polyglot readers binary search
+    them, scaling the weights down to 16 bits if needed, and returns
+    how many were written
+    """
+    scale = max(1, max(weights.values(), default=0) / 0xffff)
+
+    with open(path, 'wb') as file:
+        for (hash, move), weight in sorted(weights.items()):
+            file.write(struct.pack('>QHHI', hash, move, max(1, int(weight / scale)), 0))
+
+    return len(weights)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,30 @@
 """
 Chess AI
 """
+from array import array
+import collections
+import concurrent.futures
+import cProfile
+import itertools
+import json
 import math
+import multiprocessing
+import os
 import random
+import sqlite3
+import threading
+import time
 
 # niklasf/python-chess is licensed under GPL-3.0
 import chess
+import chess.polyglot
+import chess.syzygy
+
+# NumPy is only needed to evaluate boards in batches
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 VALUE = {
     chess.PAWN: 100,
@@ -86,56 +105,720 @@ PIECE_SQUARE = {
     ],
 }
 
+
+def square_values(value=VALUE, piece_square=PIECE_SQUARE):
+    """
+    Returns the combined piece and piece-square value of every piece on
+    every square from White's point of view, indexed by color, piece type
+    and square, with Black's tables mirrored once here instead of at every
+    lookup
+    """
+    values = {chess.WHITE: [None], chess.BLACK: [None]}
+
+    for piece_type in chess.PIECE_TYPES:
+        table = piece_square[piece_type]
+        values[chess.WHITE].append([
+            value[piece_type] + table[square] for square in chess.SQUARES
+        ])
+        values[chess.BLACK].append([
+            -value[piece_type] - table[-square - 1] for square in chess.SQUARES
+        ])
+
+    return [values[chess.BLACK], values[chess.WHITE]]
+
+
+SQUARE_VALUE = square_values()
+
+
+def load_tables(path):
+    """
+    Reads piece values and piece-square tables written by tune.py,
+    returning them in the form of VALUE and PIECE_SQUARE
+    """
+    with open(path) as file:
+        tables = json.load(file)
+
+    value = {
+        chess.PIECE_SYMBOLS.index(symbol): int(piece_value)
+        for symbol, piece_value in tables['value'].items()
+    }
+    piece_square = {
+        chess.PIECE_SYMBOLS.index(symbol): [int(entry) for entry in table]
+        for symbol, table in tables['piece_square'].items()
+    }
+
+    return value, piece_square
+
+# Number of boards converted to NumPy arrays at a time
+BATCH_SIZE = 4096
+
+# Index of each piece symbol's bitboard in board_bitboards
+PIECE_INDEX = {
+    symbol: piece_type - 1
+    for piece_type in chess.PIECE_TYPES
+    for symbol in (chess.piece_symbol(piece_type), chess.piece_symbol(piece_type).upper())
+}
+
+# Layout of the Zobrist table, which follows the Polyglot format
+ZOBRIST_CASTLING = 768
+ZOBRIST_EN_PASSANT = 772
+ZOBRIST_TURN = 780
+ZOBRIST_SIZE = 781
+
 CHECKMATE_VALUE = 10 ** 6
 SEARCH_DEPTH = 3
 
+# Bound of the alpha-beta window beyond any value a board can have
+INFINITY = 2 * CHECKMATE_VALUE
+
+# Deepest iteration of a time-managed search
+MAX_SEARCH_DEPTH = 32
+
+# Number of nodes searched between checks of the clock
+CLOCK_INTERVAL = 256
+
+# Most plies from the root for which killer moves are kept
+MAX_PLY = 128
+
+# Plies by which a null move search is shallower than a normal one
+# and the shallowest depth at which one is tried
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_DEPTH = 3
+
+# Moves searched to full depth before quiet moves are reduced
+# and the shallowest depth at which they are
+LMR_MOVES = 3
+LMR_DEPTH = 3
+
+# Sort keys that put the hash table move first, then captures and then
+# killer moves ahead of the quiet moves, which are sorted by history score
+ORDER_HINT = 1 << 62
+ORDER_CAPTURE = 1 << 61
+ORDER_KILLER = 1 << 60
+
+# Captures that cannot bring the value within this margin of the
+# alpha-beta window are skipped in quiescence search
+DELTA_MARGIN = 200
+
+# Memory budget of the transposition table in megabytes
+TABLE_SIZE_MB = 16
+
+# Most positions kept in a position cache, how many writes pass between
+# checks of its size and how many of its deepest entries a warm start loads
+CACHE_ENTRIES = 10 ** 6
+CACHE_EVICTION_INTERVAL = 100
+CACHE_WARM_ENTRIES = 10 ** 5
+
+# Largest number of pieces for which Syzygy tablebases are probed,
+# how many probe results are cached and the value of a tablebase win
+SYZYGY_PIECES = 5
+SYZYGY_CACHE_SIZE = 65536
+TABLEBASE_WIN = CHECKMATE_VALUE // 2
+
+# Kinds of values stored in the transposition table
+EXACT = 0
+LOWER = 1  # the value is at least the stored one (beta cutoff)
+UPPER = 2  # the value is at most the stored one (no move raised alpha)
+
+
+def encode_move(move):
+    """
+    Packs a move into a 16-bit integer, with 0 standing for no move
+    """
+    if move is None:
+        return 0
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    """
+    Unpacks a move packed by encode_move
+    """
+    if not code:
+        return None
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+
+def checkmate_bonus(board):
+    """
+    Returns the incentive for attacking the opponent's King from White's
+    point of view, where only a player in check can be checkmated, which
+    utility, utility_batch and evaluate all add to the piece values
+    """
+    if board.is_check() and not any(board.generate_legal_moves()):
+        return CHECKMATE_VALUE if board.turn == chess.BLACK else -CHECKMATE_VALUE
+    return 0
+
+
+def mate_in(board, value, line, depth):
+    """
+    Returns the number of moves to checkmate of a value from the point of
+    view of the player to move, negative if that player is the one mated,
+    or None if the value is not a checkmate. The plies are counted along
+    the line of best moves if it ends in checkmate, and otherwise taken
+    to be the depth searched
+    """
+    # Tablebase wins are worth exactly TABLEBASE_WIN and checkmates more
+    if abs(value) <= TABLEBASE_WIN:
+        return None
+
+    plies = depth
+    if board.is_checkmate():
+        plies = 0
+    else:
+        board = board.copy(stack=False)
+        for ply, move in enumerate(line, 1):
+            board.push(move)
+            if board.is_checkmate():
+                plies = ply
+                break
+
+    return (plies + 1) // 2 if value > 0 else -(plies // 2)
+
+
+def board_bitboards(boards):
+    """
+    Returns NumPy arrays of the bitboards of each board or FEN, shaped
+    (boards, 8) with one per piece type and then Black's and White's
+    pieces, and of whose turn it is
+    """
+    bitboards = []
+    turns = []
+
+    for board in boards:
+        if isinstance(board, str):
+            bitboards.append(fen_bitboards(board))
+            turns.append(board.split()[1] == 'w')
+        else:
+            bitboards.append((
+                board.pawns, board.knights, board.bishops,
+                board.rooks, board.queens, board.kings,
+                board.occupied_co[chess.BLACK], board.occupied_co[chess.WHITE],
+            ))
+            turns.append(board.turn)
+
+    return np.array(bitboards, dtype='<u8').reshape(-1, 8), np.array(turns, dtype=bool)
+
+
+def fen_bitboards(fen):
+    """
+    Returns the bitboards of a FEN in the order of board_bitboards,
+    reading its piece placement without setting up a whole board
+    """
+    bitboards = [0] * 8
+    square = 56
+
+    for symbol in fen.split(' ', 1)[0]:
+        if symbol == '/':
+            square -= 16
+        elif symbol in '12345678':
+            square += int(symbol)
+        else:
+            bit = 1 << square
+            bitboards[PIECE_INDEX[symbol]] |= bit
+            bitboards[6 + symbol.isupper()] |= bit
+            square += 1
+
+    return bitboards
+
+
+def piece_planes(bitboards):
+    """
+    Returns a NumPy array with a 0 or 1 for every piece type of either
+    color on every square of each board, shaped (boards, 12, 64) with
+    Black's pieces first, from the output of board_bitboards
+    """
+    # Split each piece type's bitboard by color
+    masks = bitboards[:, None, :6] & bitboards[:, 6:, None]
+
+    bits = np.unpackbits(masks.reshape(-1, 12).view(np.uint8), axis=1, bitorder='little')
+    return bits.reshape(-1, 12, 64)
+
+
+def shifted(bitboards, shift):
+    """
+    Moves every bit of some NumPy bitboards a number of squares towards h8,
+    or towards a1 if the shift is negative, dropping any that wrap around
+    a side of the board
+    """
+    file_shift = (shift + 4) % 8 - 4
+    if shift > 0:
+        bitboards = bitboards << np.uint64(shift)
+    else:
+        bitboards = bitboards >> np.uint64(-shift)
+
+    if file_shift > 0:
+        bitboards &= np.uint64(~chess.BB_FILE_A & chess.BB_ALL)
+        if file_shift > 1:
+            bitboards &= np.uint64(~chess.BB_FILE_B & chess.BB_ALL)
+    elif file_shift < 0:
+        bitboards &= np.uint64(~chess.BB_FILE_H & chess.BB_ALL)
+        if file_shift < -1:
+            bitboards &= np.uint64(~chess.BB_FILE_G & chess.BB_ALL)
+
+    return bitboards
+
+
+def checked(bitboards, turns):
+    """
+    Returns a NumPy array telling whether the player to move is in check on
+    each board, from the output of board_bitboards and an array of turns
+    """
+    pawns, knights, bishops, rooks, queens, kings, black, white = bitboards.T
+    own = np.where(turns, white, black)
+    enemy = np.where(turns, black, white)
+    empty = ~(black | white)
+    king = kings & own
+
+    # Squares a king would be attacked from by each kind of piece
+    attacks = np.where(
+        turns,
+        shifted(king, 7) | shifted(king, 9),
+        shifted(king, -7) | shifted(king, -9)
+    ) & pawns
+    for shift in (6, 10, 15, 17, -6, -10, -15, -17):
+        attacks |= shifted(king, shift) & knights
+
+    # Slide from the king in each direction until a piece is reached
+    for shift, sliders in (
+        (1, rooks), (-1, rooks), (8, rooks), (-8, rooks),
+        (7, bishops), (-7, bishops), (9, bishops), (-9, bishops),
+    ):
+        ray = king
+        for _ in range(7):
+            ray = shifted(ray, shift)
+            attacks |= ray & (sliders | queens)
+            ray &= empty
+
+    return (attacks & enemy) != 0
+
+
+class PositionCache():
+    """
+    Search results kept in an SQLite database, so that they survive restarts
+    and can be shared by engine processes, which may read it concurrently
+
+    When the database holds more than max_entries positions, the shallowest
+    searches, and among those the least recently stored, are evicted
+    """
+
+    def __init__(self, path, fingerprint, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS positions ('
+                'hash INTEGER PRIMARY KEY, value INTEGER, move INTEGER, '
+                'depth INTEGER, flag INTEGER, stored REAL)'
+            )
+
+            # Eviction and warm starts both take positions in order of depth
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS positions_depth ON positions(depth, stored)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)'
+            )
+            self.connection.execute(
+                'INSERT OR IGNORE INTO settings VALUES (?, ?)',
+                ('fingerprint', str(fingerprint))
+            )
+
+        # Hashes are only meaningful with the Zobrist keys that made them
+        stored, = self.connection.execute(
+            "SELECT value FROM settings WHERE name = 'fingerprint'"
+        ).fetchone()
+        if stored != str(fingerprint):
+            raise ValueError(f"{path} was made with different Zobrist keys")
+
+    def get(self, hash):
+        """
+        Returns the value, move code, depth and kind stored for a position,
+        or None if it is not in the cache
+        """
+        with self.lock:
+            return self.connection.execute(
+                'SELECT value, move, depth, flag FROM positions WHERE hash = ?',
+                (signed(hash),)
+            ).fetchone()
+
+    def put(self, entries):
+        """
+        Saves (hash, value, move code, depth, kind) entries, keeping
+        the deeper search of a position already in the cache
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(hash) DO UPDATE SET '
+                'value = excluded.value, move = excluded.move, depth = excluded.depth, '
+                'flag = excluded.flag, stored = excluded.stored '
+                'WHERE excluded.depth >= positions.depth',
+                [(signed(hash), *entry, now) for hash, *entry in entries]
+            )
+
+            # Counting rows takes a while, so only check the size now and then
+            self.writes += 1
+            if self.writes % CACHE_EVICTION_INTERVAL == 0:
+                count, = self.connection.execute('SELECT COUNT(*) FROM positions').fetchone()
+                if count > self.max_entries:
+                    self.connection.execute(
+                        'DELETE FROM positions WHERE hash IN ('
+                        'SELECT hash FROM positions ORDER BY depth, stored LIMIT ?)',
+                        (count - self.max_entries,)
+                    )
+
+    def deepest(self, count):
+        """
+        Returns the (hash, value, move code, depth, kind) entries
+        of the deepest searches in the cache
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT hash, value, move, depth, flag FROM positions '
+                'ORDER BY depth DESC, stored DESC LIMIT ?',
+                (count,)
+            ).fetchall()
+
+        return [(hash % 2 ** 64, *entry) for hash, *entry in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+def signed(hash):
+    """
+    Converts a 64-bit hash to the signed integers SQLite stores
+    """
+    return hash - 2 ** 64 if hash >= 2 ** 63 else hash
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when its time budget runs out
+    """
+
+
+def table_slots(size_mb=TABLE_SIZE_MB):
+    """
+    Returns the number of 16-byte slots of a transposition table, which is
+    the largest power of two within its memory budget
+    """
+    slots = max(2, size_mb * 2 ** 20 // 16)
+    return 2 ** (slots.bit_length() - 1)
+
+
+class TranspositionTable():
+    """
+    Fixed-size hash table of searched positions
+
+    Every entry takes two 64-bit words: the packed search result and the
+    Zobrist hash XORed with it, so an entry only verifies for the position
+    that stored it. Entries are grouped in buckets of two: the first slot
+    keeps the deepest search of the current move, the second slot is
+    always replaced
+    """
+
+    def __init__(self, size_mb=TABLE_SIZE_MB, buffer=None):
+
+        self.size = table_slots(size_mb)
+        self.mask = self.size // 2 - 1
+
+        # The table may live in a buffer shared with other processes,
+        # such as a multiprocessing.RawArray of 16 bytes per slot
+        if buffer is None:
+            self.keys = array('Q', bytes(8 * self.size))
+            self.data = array('Q', bytes(8 * self.size))
+        else:
+            words = memoryview(buffer).cast('B').cast('Q')
+            self.keys = words[:self.size]
+            self.data = words[self.size:2 * self.size]
+
+        # Searches are numbered so entries of earlier moves can be replaced
+        self.age = 0
+
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0
+        self.stores = 0
+
+    def probe(self, hash):
+        """
+        Returns the value, move code, depth and kind stored for a position,
+        or None if it is not in the table
+        """
+        self.probes += 1
+
+        slot = (hash & self.mask) * 2
+        for i in (slot, slot + 1):
+            data = self.data[i]
+            if self.keys[i] ^ data == hash:
+                self.hits += 1
+                return (
+                    (data >> 32) - 2 ** 31,
+                    data & 0xffff,
+                    data >> 16 & 0xff,
+                    data >> 24 & 3,
+                )
+
+        if self.data[slot]:
+            self.collisions += 1
+
+        return None
+
+    def store(self, hash, value, move, depth, flag):
+        """
+        Saves the result of searching a position
+        """
+        self.stores += 1
+
+        data = (
+            move |
+            depth << 16 |
+            flag << 24 |
+            self.age << 26 |
+            (value + 2 ** 31) << 32
+        )
+
+        # Replace the deep slot if it holds the same position, a shallower
+        # search or a search of an earlier move
+        slot = (hash & self.mask) * 2
+        stored = self.data[slot]
+        if (
+            self.keys[slot] ^ stored == hash or
+            stored >> 16 & 0xff <= depth or
+            stored >> 26 & 0x3f != self.age
+        ):
+            self.keys[slot] = hash ^ data
+            self.data[slot] = data
+        else:
+            self.keys[slot + 1] = hash ^ data
+            self.data[slot + 1] = data
+
+    def new_search(self):
+        """
+        Marks the entries stored so far as belonging to an earlier search
+        """
+        self.age = (self.age + 1) & 0x3f
+
+    def clear(self):
+        """
+        Empties the table and resets its statistics
+        """
+        self.keys[:] = array('Q', bytes(8 * self.size))
+        self.data[:] = array('Q', bytes(8 * self.size))
+        self.age = 0
+        self.probes = self.hits = self.collisions = self.stores = 0
+
+    def fill(self):
+        """
+        Returns the fraction of slots in use, estimated from the first 1000
+        """
+        sample = self.data[:1000]
+        return sum(1 for data in sample if data) / len(sample)
+
+    def stats(self):
+        """
+        Returns the table's usage statistics
+        """
+        return {
+            'size': self.size,
+            'probes': self.probes,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.probes if self.probes else 0,
+            'collisions': self.collisions,
+            'stores': self.stores,
+            'fill': self.fill(),
+        }
+
 
 class ChessAI():
 
-    def __init__(self):
+    def __init__(
+        self,
+        seed=None,
+        incremental=True,
+        table_mb=TABLE_SIZE_MB,
+        table_buffer=None,
+        ordering=True,
+        quiescence=True,
+        quiescence_checks=False,
+        null_move=True,
+        late_move_reductions=True,
+        pvs=True,
+        stats=False,
+        cache=None,
+        warm_start=False,
+        book=None,
+        syzygy=None,
+        syzygy_pieces=SYZYGY_PIECES,
+        tables=None,
+    ):
 
-        # Generate Zobrist table
-        self.zobrist = []
-        for _ in range(64):
-            row = []
-            for _ in range(12):
-                row.append(random.randrange(2**64))
-            self.zobrist.append(row)
+        # Generate Zobrist table with keys for every piece on every square,
+        # the castling rights, the en passant file and the side to move.
+        # Without a seed, the Polyglot keys are used so that hashes match
+        # chess.polyglot.zobrist_hash and stay the same between runs
+        if seed is None:
+            self.zobrist = chess.polyglot.POLYGLOT_RANDOM_ARRAY[:ZOBRIST_SIZE]
+        else:
+            rng = random.Random(seed)
+            self.zobrist = [rng.getrandbits(64) for _ in range(ZOBRIST_SIZE)]
+        self.hasher = chess.polyglot.ZobristHasher(self.zobrist)
 
         # Hash table
-        self.table = {}
+        self.table = TranspositionTable(table_mb, table_buffer)
+
+        # Update the Zobrist hash and piece values move by move during
+        # search instead of rebuilding them from scratch at every node
+        self.incremental = incremental
+        self.hash = 0
+        self.hashes = []
+        self.score = 0
+        self.scores = []
+
+        # Number of positions searched, the time by which to stop
+        # and an optional threading.Event to cancel the search with
+        self.nodes = 0
+        self.deadline = None
+        self.stop = None
+
+        # Try the moves most likely to cause a cutoff first: the hash table
+        # move, captures of the most valuable pieces by the least valuable,
+        # quiet moves that caused a cutoff at the same ply (killer moves)
+        # and quiet moves that caused many cutoffs anywhere (history)
+        self.ordering = ordering
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [[0] * 4096, [0] * 4096]
+
+        # Moves of each ply and the best move of the root, kept in lists
+        # made once instead of at every node
+        self.move_buffers = [[] for _ in range(MAX_PLY)]
+        self.decision = None
+        self.played_hashes = []
+
+        # Keep searching captures (and optionally checks) past the last ply
+        # so the board is never evaluated in the middle of an exchange
+        self.quiescence = quiescence
+        self.quiescence_checks = quiescence_checks
+
+        # Selective search: skip a turn to prove a position is good enough
+        # to cut off (null move pruning), search quiet moves ordered late
+        # less deeply (late move reductions) and search moves after the
+        # first with a null window, only searching them again in full if
+        # they turn out better (principal variation search)
+        self.null_move = null_move
+        self.late_move_reductions = late_move_reductions
+        self.pvs = pvs
+
+        # Count what the search does by wrapping the methods involved,
+        # which leaves the search untouched when statistics are off
+        self.stats = stats
+        self.counters = None
+        self.iterations = []
+        self.last_report = (0, 0)
+        if stats:
+            self.evaluate = self.counted(self.evaluate, 'evaluations')
+            self.quiesce = self.counted(self.quiesce, 'quiescence_nodes')
+            self.cutoff = self.counted(self.cutoff, 'cutoffs')
+
+        # Results of earlier searches kept on disk, which can be loaded
+        # into the hash table straight away with a warm start
+        if isinstance(cache, str):
+            cache = PositionCache(cache, self.zobrist_hash(chess.Board()))
+        self.cache = cache
+        if cache and warm_start:
+            for hash, value, move, depth, flag in cache.deepest(CACHE_WARM_ENTRIES):
+                self.table.store(hash, value, move, depth, flag)
+
+        # Polyglot opening book, which python-chess reads memory-mapped
+        # with a binary search on the position's hash
+        self.book = chess.polyglot.open_reader(book) if book else None
+
+        # Syzygy tablebases in a local directory, probed at the root and
+        # at every node with few enough pieces, with the most recently
+        # used results kept by position hash
+        self.tablebase = chess.syzygy.open_tablebase(syzygy) if syzygy else None
+        self.syzygy_pieces = syzygy_pieces
+        self.tablebase_cache = collections.OrderedDict()
+
+        # Piece values and piece-square tables fitted by tune.py, which
+        # the evaluation uses instead of VALUE and PIECE_SQUARE if given
+        self.square_value = square_values(*load_tables(tables)) if tables else SQUARE_VALUE
 
     def utility(self, board):
         """
         Evaluates the value of the board based on fixed piece valuations
         """
-        utility = 0
+        return self.piece_values(board) + checkmate_bonus(board)
 
-        # Increment or decrement piece and piece-position values
-        for square in board.piece_map():
+    def utility_batch(self, boards):
+        """
+        Evaluates many boards or FENs at once with NumPy, returning
+        the same values as utility in an array
+        """
+        if np is None:
+            raise ImportError("evaluating boards in batches requires numpy")
 
-            # For Black's pieces, start indexing the piece-square tables at the end
-            position = (
-                square if board.color_at(square) == chess.WHITE else
-                -square - 1
-            )
+        weights = np.array([
+            self.square_value[color][piece_type]
+            for color in chess.COLORS[::-1]
+            for piece_type in chess.PIECE_TYPES
+        ], dtype=np.float32).reshape(-1)
 
-            if board.color_at(square) == chess.WHITE:
-                utility += VALUE[board.piece_type_at(square)]
-                utility += PIECE_SQUARE[board.piece_type_at(square)][position]
-            else:
-                utility -= VALUE[board.piece_type_at(square)]
-                utility -= PIECE_SQUARE[board.piece_type_at(square)][position]
+        utilities = []
+        boards = iter(boards)
+        while chunk := list(itertools.islice(boards, BATCH_SIZE)):
+            bitboards, turns = board_bitboards(chunk)
+            planes = piece_planes(bitboards).reshape(len(chunk), -1)
 
-        # Incentive for attacking the opponent's King
-        if board.is_checkmate():
-            if board.outcome().winner == chess.WHITE:
-                utility += CHECKMATE_VALUE
-            else:
-                utility -= CHECKMATE_VALUE
+            # Single precision is exact for sums of this size
+            utility = (planes.astype(np.float32) @ weights).astype(np.int64)
+
+            # Incentive for attacking the opponent's King, only looking
+            # for legal moves on the boards where a king is in check
+            for i in np.flatnonzero(checked(bitboards, turns)):
+                board = chunk[i]
+                if isinstance(board, str):
+                    board = chess.Board(board)
+                utility[i] += checkmate_bonus(board)
+
+            utilities.append(utility)
+
+        if not utilities:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(utilities)
+
+    def piece_values(self, board):
+        """
+        Sums the piece and piece-position values of the pieces on the board
+        """
+        utility = 0
+
+        for color in chess.COLORS:
+            values = self.square_value[color]
+            for piece_type in chess.PIECE_TYPES:
+                table = values[piece_type]
+                for square in chess.scan_reversed(board.pieces_mask(piece_type, color)):
+                    utility += table[square]
 
         return utility
 
+    def evaluate(self, board):
+        """
+        Returns the same value as utility for the board being searched,
+        starting from the incrementally updated piece values
+        """
+        if not self.incremental:
+            return self.utility(board)
+
+        return self.score + checkmate_bonus(board)
+
     def minimax(self, board, depth=SEARCH_DEPTH):
         """
         Returns the optimal action for the current player on the board
@@ -143,84 +826,749 @@ class ChessAI():
 
         Pseudocode from Russell and Norvig (2021)
         """
+        if move := self.book_move(board):
+            return self.utility(board), move
+        if result := self.tablebase_move(board):
+            return result
+
+        self.start(board)
+        result = self.root(board, depth)
+        self.remember(board, depth)
+        return result
+
+    def search(
+        self,
+        board,
+        movetime=None,
+        deadline=None,
+        depth=MAX_SEARCH_DEPTH,
+        stop=None,
+        callback=None,
+    ):
+        """
+        Returns the optimal action for the current player on the board
+        by searching one ply deeper at a time until the depth is reached,
+        the stop event is set or the time budget, in milliseconds or as a
+        time.monotonic() deadline, runs out
+
+        The result of the last completed iteration is returned, and each
+        iteration tries the best moves of the previous one first. After
+        every iteration, the callback is called with a dict of its depth,
+        value, move, nodes, time and nodes per second
+        """
+        if move := self.book_move(board):
+            return self.utility(board), move
+        if result := self.tablebase_move(board):
+            return result
+
+        started = time.monotonic()
+        if movetime is not None:
+            deadline = min(deadline or math.inf, started + movetime / 1000)
+
+        self.start(board)
+
+        # The first iteration always completes so there is a move to return
+        result = self.root(board, 1)
+        self.report(board, callback, 1, result, started)
+        self.deadline = deadline
+        self.stop = stop
+
+        for iteration in range(2, depth + 1):
+
+            if stop and stop.is_set():
+                break
+
+            # Stop if the next iteration is unlikely to finish in time
+            if deadline and time.monotonic() - started > (deadline - started) / 2:
+                break
+
+            # Stop if a forced checkmate was found
+            if abs(result[0]) >= CHECKMATE_VALUE // 2:
+                break
+
+            try:
+                result = self.root(board, iteration)
+            except SearchTimeout:
+                while self.hashes:
+                    self.pop(board)
+                break
+
+            self.report(board, callback, iteration, result, started)
+
+        self.deadline = None
+        self.stop = None
+        self.remember(board, depth)
+        return result
+
+    def book_move(self, board):
+        """
+        Returns a move from the opening book for the board, chosen at random
+        in proportion to the weights of the book's moves, or None
+        """
+        if not self.book:
+            return None
+
+        try:
+            return self.book.weighted_choice(board).move
+        except IndexError:
+            return None
+
+    def tablebase_move(self, board):
+        """
+        Returns the value and the best move of the board from the tablebases,
+        or None if the board is not in them
+
+        Winning moves that reset the fifty-move counter soonest are preferred,
+        and losing moves that delay it longest
+        """
+        if not self.in_tablebase(board):
+            return None
+
+        best = None
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            try:
+                wdl = self.tablebase.probe_wdl(board)
+                dtz = self.tablebase.probe_dtz(board)
+            except KeyError:
+                return None
+            finally:
+                board.pop()
+
+            # Lower is better for the player to move: the opponent's result,
+            # then how soon a win progresses or how late a loss does
+            rank = (wdl, 0 if zeroing and wdl < 0 else -dtz if wdl else 0)
+            if best is None or rank < best[0]:
+                best = rank, move
+
+        if best is None:
+            return None
+
+        value = self.tablebase_value(-best[0][0], board.turn)
+        return value, best[1]
+
+    def probe_tablebase(self, board):
+        """
+        Returns the value of the board from the tablebases, or None
+        if the board is not in them
+        """
+        if not self.in_tablebase(board):
+            return None
+
+        cache = self.tablebase_cache
+        hash = self.position_hash(board)
+        if hash in cache:
+            cache.move_to_end(hash)
+            return cache[hash]
+
+        try:
+            value = self.tablebase_value(self.tablebase.probe_wdl(board), board.turn)
+        except KeyError:
+            value = None
+
+        cache[hash] = value
+        if len(cache) > SYZYGY_CACHE_SIZE:
+            cache.popitem(last=False)
+
+        return value
+
+    def in_tablebase(self, board):
+        """
+        Returns whether the board may be in the tablebases
+        """
+        return (
+            self.tablebase is not None and
+            not board.castling_rights and
+            chess.popcount(board.occupied) <= self.syzygy_pieces
+        )
+
+    def tablebase_value(self, wdl, turn):
+        """
+        Converts a tablebase result for the player to move into a value,
+        counting wins and losses spoiled by the fifty-move rule as draws
+        """
+        value = TABLEBASE_WIN if wdl == 2 else -TABLEBASE_WIN if wdl == -2 else 0
+        return value if turn == chess.WHITE else -value
+
+    def remember(self, board, depth):
+        """
+        Saves the hash table entries along the principal variation
+        to the position cache, if there is one
+        """
+        if not self.cache:
+            return
+
+        entries = []
+        line = self.principal_variation(board, depth)
+        for move in line:
+            if entry := self.table.probe(self.hash):
+                entries.append((self.hash, *entry))
+            self.push(board, move)
+        for _ in line:
+            self.pop(board)
+
+        self.cache.put(entries)
+
+    def report(self, board, callback, depth, result, started):
+        """
+        Passes the progress of a search to its callback, if any, and
+        records the time and nodes of each iteration if statistics are on
+        """
+        if callback is None and not self.stats:
+            return
+
+        elapsed = time.monotonic() - started
+        info = {
+            'depth': depth,
+            'value': result[0],
+            'move': result[1],
+            'pv': self.principal_variation(board, depth),
+            'nodes': self.nodes,
+            'time': elapsed,
+            'nps': int(self.nodes / elapsed) if elapsed else 0,
+        }
+
+        if self.stats:
+            # The elapsed time and nodes are totals since the search started
+            previous_time, previous_nodes = self.last_report
+            self.iterations.append({
+                'depth': depth,
+                'time': elapsed - previous_time,
+                'nodes': self.nodes - previous_nodes,
+            })
+            self.last_report = elapsed, self.nodes
+            info['stats'] = self.search_stats()
+
+        if callback:
+            callback(info)
+
+    def search_stats(self):
+        """
+        Returns the counters of the current or last search, which
+        include more than the node count if statistics are on
+        """
+        stats = {'nodes': self.nodes}
+
+        if self.counters is not None:
+            stats.update(self.counters)
+            for counter in ('probes', 'hits', 'stores'):
+                stats['tt_' + counter] = getattr(self.table, counter) - self.table_counters[counter]
+            stats['iterations'] = list(self.iterations)
+
+        return stats
+
+    def counted(self, method, counter):
+        """
+        Wraps a method so that each call increments a counter
+        """
+        def wrapper(*args, **kwargs):
+            self.counters[counter] += 1
+            return method(*args, **kwargs)
+
+        return wrapper
+
+    def principal_variation(self, board, depth):
+        """
+        Returns the line of best moves from the board stored in hash table,
+        up to the given number of moves
+        """
+        line = []
+        seen = set()
+
+        hash = self.zobrist_hash(board)
+        while len(line) < depth and hash not in seen:
+            seen.add(hash)
+            entry = self.table.probe(hash)
+            move = decode_move(entry[1]) if entry else None
+            if not move or not board.is_legal(move):
+                break
+            line.append(move)
+            self.push(board, move)
+            hash = self.hash
+
+        for _ in line:
+            self.pop(board)
+
+        return line
+
+    def profile(self, board, path, **kwargs):
+        """
+        Runs search under cProfile and saves the profile to a file that
+        pstats, snakeviz or flameprof can read, returning the search result
+        """
+        profiler = cProfile.Profile()
+        result = profiler.runcall(self.search, board, **kwargs)
+        profiler.dump_stats(path)
+        return result
+
+    def perft(self, board, depth, validate=False):
+        """
+        Counts the positions reached by every sequence of legal moves of the
+        given length, generating and making the moves the way the search
+        does, so the count can be checked against known ones
+
+        With validate, the incrementally updated hash and piece values
+        are also checked against ones computed from scratch everywhere
+        """
+        self.start(board)
+        return self.count_positions(board, depth, validate)
+
+    def count_positions(self, board, depth, validate):
+        """
+        Counts the positions depth moves from the board for perft
+        """
+        if validate and (
+            self.hash != self.zobrist_hash(board) or
+            self.score != self.piece_values(board)
+        ):
+            raise ValueError(f"incremental hash or piece values are wrong after {board.move_stack}")
+
+        if not depth:
+            return 1
+
+        moves = self.ordered_moves(board, None)
+        if depth == 1 and not validate:
+            return len(moves)
+
+        count = 0
+        for move in moves:
+            self.push(board, move)
+            count += self.count_positions(board, depth - 1, validate)
+            self.pop(board)
+
+        return count
+
+    def start(self, board):
+        """
+        Resets the search state for a new root position
+        """
+        self.hash = self.zobrist_hash(board)
+        self.hashes = []
+        self.score = self.piece_values(board)
+        self.scores = []
+        self.nodes = 0
+        self.deadline = None
+        self.table.new_search()
+
+        # Hashes of the positions played since the last capture or pawn
+        # move, which the search must not repeat
+        self.played_hashes = []
+        played = board.copy()
+        for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+            played.pop()
+            self.played_hashes.append(self.zobrist_hash(played))
+        self.played_hashes.reverse()
+
+        # Start from what an earlier game or process found
+        if self.cache and (entry := self.cache.get(self.hash)):
+            self.table.store(self.hash, *entry)
+
+        if self.stats:
+            self.counters = {'evaluations': 0, 'quiescence_nodes': 0, 'cutoffs': 0}
+            self.table_counters = {
+                'probes': self.table.probes,
+                'hits': self.table.hits,
+                'stores': self.table.stores,
+            }
+            self.iterations = []
+            self.last_report = (0, 0)
+
+        # Killer moves only apply to the positions of one search,
+        # while history scores fade from one search to the next
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        for scores in self.history:
+            for i, score in enumerate(scores):
+                if score:
+                    scores[i] = score // 2
+
+    def root(self, board, depth):
+        """
+        Searches the root position to the given depth, returning the value
+        from White's point of view and the best move
+        """
+        self.decision = None
+        value = self.negamax(board, depth, -INFINITY, INFINITY)
+        if board.turn == chess.BLACK:
+            value = -value
+        return value, self.decision
+
+    def negamax(self, board, depth, alpha, beta):
+        """
+        Returns the value of the board for the player to move, searching it
+        to the given depth within the alpha-beta window, and keeps the best
+        move of the root position in self.decision
+
+        Negamax formulation of minimax from Knuth and Moore (1975)
+        """
+        self.tick()
+
+        ply = len(self.hashes)
+        hash = self.position_hash(board)
+
+        # Draws are found without generating any moves, and checkmate
+        # and stalemate once no legal move has been found below
+        if ply and self.is_draw(board, hash):
+            return 0
+
+        # The hash table holds values and bounds from White's point of view
         if board.turn == chess.WHITE:
-            return self.max_value(board, depth)
+            sign = 1
+            window = alpha, beta
         else:
-            return self.min_value(board, depth)
-
-    def max_value(self, board, depth, alpha=-math.inf, beta=math.inf):
+            sign = -1
+            window = -beta, -alpha
 
         # Return value and decision from hash table if board position has already been encountered
-        if (hash := self.zobrist_hash(board)) in self.table:
-            if self.table[hash]['depth'] >= depth:
-                return self.table[hash]['value'], self.table[hash]['decision']
+        entry, hint = self.lookup(hash, depth, *window)
+        if entry:
+            if not ply:
+                self.decision = hint
+            return sign * entry[0]
+
+        # Endgames in the tablebases are scored without searching them
+        if self.tablebase and ply:
+            if (value := self.probe_tablebase(board)) is not None:
+                return sign * value
 
         # Base condition
-        if not depth or board.is_game_over():
-            return self.utility(board), None
+        if not depth:
+            if not self.quiescence:
+                return sign * self.evaluate(board)
+            return self.quiesce(board, alpha, beta)
 
-        value = -math.inf
+        # If the opponent cannot bring the value below beta even when
+        # the player to move passes, a real move would do at least as well
+        if self.can_null_move(board, depth, beta):
+            self.push(board, chess.Move.null())
+            score = -self.negamax(board, depth - 1 - NULL_MOVE_REDUCTION, -beta, 1 - beta)
+            self.pop(board)
+            if score >= beta:
+                return beta
 
-        for action in board.legal_moves:
-            board.push(action)
-            score = self.min_value(board, depth - 1, alpha, beta)[0]
-            board.pop()
+        in_check = board.is_check()
+        value = -INFINITY
+        decision = None
+
+        moves = self.ordered_moves(board, hint)
+        for index, action in enumerate(moves):
+            reduction = self.reduction(board, action, index, depth, in_check)
+            self.push(board, action)
+            if index and (self.pvs or reduction) and alpha > -INFINITY:
+                score = -self.negamax(board, depth - 1 - reduction, -alpha - 1, -alpha)
+                if score > alpha and (reduction or score < beta):
+                    score = -self.negamax(board, depth - 1, -beta, -alpha)
+            else:
+                score = -self.negamax(board, depth - 1, -beta, -alpha)
+            self.pop(board)
             if score > value:
                 value, decision = score, action
-                alpha = max(alpha, value)
-            if value > beta:
-                self.record(hash, value, decision, depth)
-                return value, decision
-            elif value == beta:
-                if random.randint(0, 1):
-                    self.record(hash, value, decision, depth)
-                    return value, decision
+                if value >= beta:
+                    self.cutoff(board, decision, depth)
+                    break
+                if value > alpha:
+                    alpha = value
 
-        self.record(hash, value, decision, depth)
-        return value, decision
+            # The other moves are only generated once the hash table move
+            # has failed to cause a cutoff
+            if not index and action == hint:
+                self.add_moves(board, moves, hint)
 
-    def min_value(self, board, depth, alpha=-math.inf, beta=math.inf):
+        # Checkmate, or stalemate, which is a draw
+        if decision is None:
+            return sign * self.evaluate(board) if in_check else 0
 
-        # Return value and decision from hash table if board position has already been encountered
-        if (hash := self.zobrist_hash(board)) in self.table:
-            if self.table[hash]['depth'] >= depth:
-                return self.table[hash]['value'], self.table[hash]['decision']
+        if not ply:
+            self.decision = decision
+        self.record(hash, sign * value, decision, depth, window)
+        return value
 
-        # Base condition
-        if not depth or board.is_game_over():
-            return self.utility(board), None
+    def is_draw(self, board, hash):
+        """
+        Returns whether the board is drawn by the fifty-move rule, by a lack
+        of material to checkmate with or by repeating an earlier position
 
-        value = math.inf
+        Checkmate takes precedence over the fifty-move rule, so a move that
+        mates on the hundredth half-move is still a win
+        """
+        if board.halfmove_clock >= 100:
+            return not board.is_check() or any(board.generate_legal_moves())
 
-        for action in board.legal_moves:
-            board.push(action)
-            score = self.max_value(board, depth - 1, alpha, beta)[0]
-            board.pop()
-            if score < value:
-                value, decision = score, action
-                beta = min(beta, value)
-            if value < alpha:
-                self.record(hash, value, decision, depth)
-                return value, decision
-            elif value == alpha:
-                if random.randint(0, 1):
-                    self.record(hash, value, decision, depth)
-                    return value, decision
+        # A lone knight or bishop cannot checkmate
+        if not (board.pawns | board.rooks | board.queens) and chess.popcount(board.knights | board.bishops) <= 1:
+            return True
+
+        return self.is_repetition(board, hash)
+
+    def is_repetition(self, board, hash):
+        """
+        Returns whether the board repeats a position of the search or of the
+        game before it, comparing its hash with those of the positions with
+        the same player to move since the last capture or pawn move
+        """
+        hashes = self.hashes
+        played = self.played_hashes
+
+        for back in range(4, board.halfmove_clock + 1, 2):
+            index = len(hashes) - back
+            if index >= 0:
+                if hashes[index] == hash:
+                    return True
+            elif -index <= len(played):
+                if played[index] == hash:
+                    return True
+            else:
+                break
+
+        return False
+
+    def can_null_move(self, board, depth, beta):
+        """
+        Returns whether to try passing the turn before searching the moves,
+        which is not done at the root, in check, right after another null
+        move or when the player to move only has pawns left, as passing is
+        then often better than any move (zugzwang)
+        """
+        if not self.null_move or depth < NULL_MOVE_DEPTH or not self.hashes or beta >= INFINITY:
+            return False
+        if board.move_stack and not board.move_stack[-1]:
+            return False
+        if board.is_check():
+            return False
+        return bool(board.occupied_co[board.turn] & ~(board.pawns | board.kings))
+
+    def reduction(self, board, move, index, depth, in_check):
+        """
+        Returns how many plies less deep to search a move, reducing quiet
+        moves ordered late as they rarely turn out to be the best
+        """
+        if (
+            not self.late_move_reductions or index < LMR_MOVES or depth < LMR_DEPTH or in_check or
+            move.promotion or board.is_capture(move) or board.gives_check(move)
+        ):
+            return 0
+        return 1
+
+    def tick(self):
+        """
+        Counts a searched node and stops the search if it is out of time
+        """
+        self.nodes += 1
+        if not self.nodes % CLOCK_INTERVAL:
+            if self.deadline and time.monotonic() >= self.deadline:
+                raise SearchTimeout
+            if self.stop and self.stop.is_set():
+                raise SearchTimeout
+
+    def lookup(self, hash, depth, alpha, beta):
+        """
+        Returns the value and decision from hash table if the stored search
+        is deep enough and its value is usable within alpha and beta,
+        along with the stored decision to try first otherwise
+        """
+        if entry := self.table.probe(hash):
+            value, decision, stored_depth, flag = entry
+            decision = decode_move(decision)
+            if stored_depth >= depth and (
+                flag == EXACT or
+                flag == LOWER and value >= beta or
+                flag == UPPER and value <= alpha
+            ):
+                return (value, decision), decision
+            return None, decision
+
+        return None, None
+
+    def move_buffer(self):
+        """
+        Returns the emptied move list of the current ply, which is made
+        once and reused by every node searched at that ply
+        """
+        ply = len(self.hashes)
+        if ply >= MAX_PLY:
+            return []
+
+        moves = self.move_buffers[ply]
+        moves.clear()
+        return moves
+
+    def ordered_moves(self, board, hint):
+        """
+        Returns the legal moves in the move buffer of the current ply,
+        best first. If the best move found by an earlier search of the
+        position is legal, the buffer only holds it until add_moves is
+        called, as it often causes a cutoff by itself
+        """
+        moves = self.move_buffer()
+        if hint and board.is_legal(hint):
+            moves.append(hint)
+        else:
+            self.add_moves(board, moves, None)
+
+        return moves
+
+    def add_moves(self, board, moves, hint):
+        """
+        Adds the legal moves other than the hash table move to a move buffer,
+        with captures of the most valuable pieces by the least valuable first,
+        then killer moves and quiet moves by their history scores
+
+        The moves are sorted in the buffer itself, which keeps the hash table
+        move, if any, at the front
+        """
+        if not self.ordering:
+            moves.extend(move for move in board.generate_legal_moves() if move != hint)
+            return
+
+        ply = len(self.hashes)
+        first, second = self.killers[ply] if ply < MAX_PLY else (None, None)
+        history = self.history[board.turn]
+
+        def order(move):
+            if move == hint:
+                return ORDER_HINT
+            # Most valuable victim, least valuable attacker
+            if board.is_capture(move) or move.promotion:
+                return ORDER_CAPTURE + self.capture_score(board, move)
+            if move == first:
+                return ORDER_KILLER + 1
+            if move == second:
+                return ORDER_KILLER
+            return history[move.from_square * 64 + move.to_square]
+
+        moves.clear()
+        moves.extend(board.generate_legal_moves())
+        moves.sort(key=order, reverse=True)
+
+    def quiesce(self, board, alpha, beta, ply=0):
+        """
+        Returns the value of the board for the player to move once
+        no captures are left to make
+
+        The player to move may stand pat, keeping the static value, instead
+        of capturing, unless they are in check
+        """
+        self.tick()
+
+        sign = 1 if board.turn == chess.WHITE else -1
+
+        # Every move out of check is searched and nobody can stand pat
+        if board.is_check():
+            moves = self.ordered_moves(board, None)
+            if not moves:
+                return sign * self.evaluate(board)
+            stand_pat = None
+            value = -INFINITY
+
+        else:
+            stand_pat = value = sign * self.evaluate(board)
+            if value >= beta:
+                return value
+            if value > alpha:
+                alpha = value
+            moves = self.noisy_moves(board, self.quiescence_checks and not ply)
+
+        for move in moves:
+
+            if stand_pat is not None and not move.promotion:
+                gain = self.capture_gain(board, move)
+
+                # Delta pruning
+                if stand_pat + gain + DELTA_MARGIN <= alpha:
+                    continue
 
-        self.record(hash, value, decision, depth)
-        return value, decision
+                # Skip captures of defended pieces that are worth less
+                # than the capturing piece
+                if (
+                    gain < VALUE[board.piece_type_at(move.from_square)] and
+                    board.is_attacked_by(not board.turn, move.to_square)
+                ):
+                    continue
 
-    def record(self, hash, value, decision, depth):
+            self.push(board, move)
+            score = -self.quiesce(board, -beta, -alpha, ply + 1)
+            self.pop(board)
+
+            if score > value:
+                value = score
+                if value >= beta:
+                    return value
+                if value > alpha:
+                    alpha = value
+
+        return value
+
+    def noisy_moves(self, board, checks=False):
+        """
+        Returns the legal captures and promotions, best first,
+        and optionally the quiet moves that give check after them
+        """
+        moves = self.move_buffer()
+
+        # Only the moves to the opponent's pieces and to the back ranks
+        # are generated, rather than every legal move
+        moves.extend(board.generate_legal_captures())
+        moves.extend(board.generate_legal_moves(board.pawns, chess.BB_BACKRANKS & ~board.occupied))
+        moves.sort(key=lambda move: self.capture_score(board, move), reverse=True)
+
+        if checks:
+            for move in board.generate_legal_moves(to_mask=~board.occupied):
+                if not move.promotion and not board.is_en_passant(move) and board.gives_check(move):
+                    moves.append(move)
+
+        return moves
+
+    def capture_gain(self, board, move):
+        """
+        Returns the value of the piece a capture or promotion gains
+        """
+        victim = board.piece_type_at(move.to_square)
+        if not victim:
+            victim = chess.PAWN if board.is_en_passant(move) else None
+
+        gain = VALUE[victim] if victim else 0
+        if move.promotion:
+            gain += VALUE[move.promotion] - VALUE[chess.PAWN]
+
+        return gain
+
+    def capture_score(self, board, move):
         """
-        Loads board configuration to hash table
+        Ranks a capture or promotion by the value of the piece it gains
+        and then by the value of the piece that makes it
         """
-        if hash not in self.table:
-            self.table[hash] = {}
+        gain = self.capture_gain(board, move)
+        return gain * 100 - VALUE[board.piece_type_at(move.from_square)]
 
-        # Add or update values
-        self.table[hash]['value'] = value
-        self.table[hash]['decision'] = decision
-        self.table[hash]['depth'] = depth
+    def cutoff(self, board, move, depth):
+        """
+        Remembers a quiet move that caused an alpha-beta cutoff
+        as a killer move and in the history scores
+        """
+        if not self.ordering or board.is_capture(move) or move.promotion:
+            return
+
+        ply = len(self.hashes)
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+
+        self.history[board.turn][move.from_square * 64 + move.to_square] += depth * depth
+
+    def record(self, hash, value, decision, depth, window):
+        """
+        Loads board configuration to hash table, marking whether the value
+        is exact or only a bound given the alpha-beta window it was found in
+        """
+        alpha, beta = window
+        flag = (
+            LOWER if value >= beta else
+            UPPER if value <= alpha else
+            EXACT
+        )
+        self.table.store(hash, value, encode_move(decision), depth, flag)
 
     def zobrist_hash(self, board):
         """
@@ -228,13 +1576,288 @@ class ChessAI():
 
         Hashing algorithm from Zobrist (1970)
         """
-        pieces = board.piece_map()
+        return self.hasher(board)
+
+    def position_hash(self, board):
+        """
+        Returns the Zobrist hash of the board position being searched
+        """
+        if self.incremental:
+            return self.hash
+        return self.zobrist_hash(board)
+
+    def push(self, board, move):
+        """
+        Makes a move on the board and updates the Zobrist hash and piece
+        values using only the contents of the squares the move touches
+        """
+        self.hashes.append(self.hash)
+        self.scores.append(self.score)
+
+        squares = self.touched_squares(board, move)
+        key, value = self.square_contents(board, squares)
+        self.hash ^= key
+        self.score -= value
+
+        castling_rights = board.castling_rights
+        if board.ep_square is not None:
+            self.hash ^= self.hasher.hash_ep_square(board)
+
+        board.push(move)
+
+        key, value = self.square_contents(board, squares)
+        self.hash ^= key
+        self.score += value
+
+        if board.castling_rights != castling_rights:
+            self.hash ^= self.castling_key(castling_rights)
+            self.hash ^= self.castling_key(board.castling_rights)
+        if board.ep_square is not None:
+            self.hash ^= self.hasher.hash_ep_square(board)
+
+        self.hash ^= self.zobrist[ZOBRIST_TURN]
+
+    def pop(self, board):
+        """
+        Takes back the last move and restores the previous Zobrist hash
+        and piece values
+        """
+        board.pop()
+        self.hash = self.hashes.pop()
+        self.score = self.scores.pop()
+
+    def square_contents(self, board, squares):
+        """
+        Returns the combined Zobrist key and piece values of the pieces
+        on some squares
+        """
+        key = 0
+        value = 0
+
+        square_value = self.square_value
+        white = board.occupied_co[chess.WHITE]
+        for square in squares:
+            piece_type = board.piece_type_at(square)
+            if piece_type:
+                color = bool(white & chess.BB_SQUARES[square])
+                key ^= self.zobrist[64 * (piece_type * 2 - 2 + color) + square]
+                value += square_value[color][piece_type][square]
+
+        return key, value
+
+    def castling_key(self, castling_rights):
+        """
+        Returns the combined Zobrist key of a set of castling rights
+        """
+        key = 0
+        for i, rook in enumerate((chess.BB_H1, chess.BB_A1, chess.BB_H8, chess.BB_A8)):
+            if castling_rights & rook:
+                key ^= self.zobrist[ZOBRIST_CASTLING + i]
+
+        return key
+
+    def touched_squares(self, board, move):
+        """
+        Returns the squares whose contents change when a move is made
+        """
+        # A null move only passes the turn
+        if not move:
+            return []
+
+        squares = [move.from_square, move.to_square]
+
+        # The rook also moves when castling
+        if board.is_castling(move):
+            rank = chess.square_rank(move.from_square)
+            if chess.square_file(move.to_square) > chess.square_file(move.from_square):
+                squares += [chess.square(7, rank), chess.square(5, rank)]
+            else:
+                squares += [chess.square(0, rank), chess.square(3, rank)]
+
+        # The captured pawn is not on the destination square
+        elif board.is_en_passant(move):
+            squares.append(chess.square(
+                chess.square_file(move.to_square),
+                chess.square_rank(move.from_square)
+            ))
+
+        return squares
+
+
+class BackgroundSearch():
+    """
+    Runs ChessAI.search on a copy of a board in a separate thread,
+    keeping the latest progress of the search and its result
+    """
+
+    def __init__(self, ai, board, **kwargs):
+        self.ai = ai
+        self.stop = threading.Event()
+        self.info = None
+        self.result = None
+
+        self.thread = threading.Thread(
+            target=self.run,
+            args=(board.copy(),),
+            kwargs=kwargs,
+            daemon=True
+        )
+        self.thread.start()
+
+    def run(self, board, **kwargs):
+        self.result = self.ai.search(
+            board,
+            stop=self.stop,
+            callback=self.progress,
+            **kwargs
+        )
+
+    def progress(self, info):
+        self.info = info
+
+    def done(self):
+        """
+        Returns whether the search has finished
+        """
+        return not self.thread.is_alive()
+
+    def cancel(self):
+        """
+        Stops the search and waits for the thread to finish
+        """
+        self.stop.set()
+        self.thread.join()
+
+
+class PonderSearch():
+    """
+    Searches in the background while the opponent is thinking (pondering),
+    filling the AI's transposition table for the position after the move
+    the opponent is expected to make, or for the opponent's position itself
+    so that every reply is searched to one ply less, when there is no guess
+    """
+
+    def __init__(self, ai, board, guess=None):
+        self.ai = ai
+        self.guess = guess if guess and board.is_legal(guess) else None
+
+        self.position = board.copy()
+        if self.guess:
+            self.position.push(self.guess)
+
+        self.started = time.monotonic()
+        self.search = BackgroundSearch(ai, self.position)
+
+    def respond(self, board, movetime):
+        """
+        Stops pondering once the opponent has moved and returns the
+        BackgroundSearch of the AI's reply to the board
+
+        If the opponent made the expected move (a ponder hit), the time
+        spent pondering counts towards the movetime, and the finished
+        ponder search is returned at once if it has used up all of it.
+        Otherwise the reply is searched as usual with a warm table
+        """
+        self.search.cancel()
+
+        if self.guess and board.fen() == self.position.fen():
+            remaining = movetime - (time.monotonic() - self.started) * 1000
+            if remaining <= 0 and self.search.result and self.search.result[1]:
+                return self.search
+            movetime = max(1, remaining)
+
+        return BackgroundSearch(self.ai, board, movetime=movetime)
+
+    def cancel(self):
+        """
+        Stops pondering
+        """
+        self.search.cancel()
+
+
+class ParallelSearch():
+    """
+    Searches a position with several processes at once (Lazy SMP)
+
+    Every process runs ChessAI.search on the same position, and all of them
+    share one transposition table in shared memory so each one benefits from
+    the positions the others have searched. Helper processes order quiet
+    moves slightly differently so they explore different parts of the tree,
+    and the deepest completed result is played
+    """
+
+    def __init__(self, workers=None, table_mb=TABLE_SIZE_MB, **options):
+        self.workers = workers or os.cpu_count()
+        self.nodes = 0
+
+        self.buffer = multiprocessing.RawArray('B', 16 * table_slots(table_mb))
+        self.table = TranspositionTable(table_mb, self.buffer)
+
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers,
+            initializer=start_worker,
+            initargs=(self.buffer, table_mb, options)
+        )
+
+    def search(self, board, movetime=None, depth=MAX_SEARCH_DEPTH):
+        """
+        Returns the optimal action for the current player on the board
+        found by the deepest search of any process, like ChessAI.search
+        """
+        futures = [
+            self.pool.submit(search_worker, board, index, movetime, depth)
+            for index in range(self.workers)
+        ]
+        results = [future.result() for future in futures]
+        self.nodes = sum(result[3] for result in results)
+
+        # On equal depths, max keeps the main process's result
+        _, value, move, _ = max(results, key=lambda result: result[0])
+        return value, move
+
+    def close(self):
+        """
+        Shuts down the worker processes
+        """
+        self.pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ChessAI of a ParallelSearch worker process
+worker_ai = None
+
+
+def start_worker(buffer, table_mb, options):
+    """
+    Sets up a worker process's ChessAI on the shared transposition table
+    """
+    global worker_ai
+    worker_ai = ChessAI(table_mb=table_mb, table_buffer=buffer, **options)
+
+
+def search_worker(board, index, movetime, depth):
+    """
+    Searches a position in a worker process, returning the depth reached,
+    the value and move found and the number of nodes searched
+    """
+    # Helpers start from randomly perturbed history scores
+    if index:
+        rng = random.Random(index)
+        for scores in worker_ai.history:
+            for i in range(len(scores)):
+                scores[i] += rng.randrange(64)
 
-        hash = 0
-        for square in chess.SQUARES:
-            if square in pieces:
-                piece = pieces[square]
-                piece_type = piece.piece_type + piece.color * 6 - 1
-                hash ^= self.zobrist[square][piece_type]
+    info = {'depth': 0}
+    value, move = worker_ai.search(
+        board,
+        movetime=movetime,
+        depth=depth,
+        callback=info.update
+    )
 
-        return hash
+    return info['depth'], value, move, worker_ai.nodes
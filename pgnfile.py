@@ -0,0 +1,44 @@
+"""
+Read the games in PGN files one at a time, for the scripts that process them
+"""
+# niklasf/python-chess is licensed under GPL-3.0
+import chess.pgn
+
+
+class RecordedLines():
+    """
+    File opened in text mode that keeps the lines read from it, so the text
+    of each game python-chess reads can be taken from it
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.lines = []
+
+    def readline(self):
+        line = self.file.readline()
+        self.lines.append(line)
+        return line
+
+    def take(self):
+        """
+        Returns the text read since the last call and forgets it
+        """
+        text = ''.join(self.lines)
+        self.lines = []
+        return text
+
+
+def read_games(paths):
+    """
+    Generates the games in some PGN files as text, one at a time
+
+    python-chess finds where each game ends, so comments and variations
+    that span lines are kept whole, and only the tags of each game are
+    parsed here
+    """
+    for path in paths:
+        with open(path, errors='replace') as file:
+            lines = RecordedLines(file)
+            while chess.pgn.read_headers(lines) is not None:
+                yield lines.take()
@@ -4,7 +4,6 @@ Play chess against an AI
 import random
 import os
 import sys
-import time
 
 # niklasf/python-chess is licensed under GPL-3.0
 import chess
@@ -21,12 +20,24 @@ SIZE = WIDTH, HEIGHT = 500, 600
 REGULAR_FONT = os.path.join('assets', 'fonts', 'JetBrainsMono-Regular.ttf')
 BOLD_FONT = os.path.join('assets', 'fonts', 'JetBrainsMono-Bold.ttf')
 
+# Opening book used by the AI if present
+BOOK = os.path.join('assets', 'book.bin')
+
 # Colors
 WHITE = (255, 255, 255)
 GRAY = (192, 192, 192)
 BLACK = (0, 0, 0)
 HIGHLIGHT = (16, 128, 255)
 
+# Frames drawn per second
+FPS = 30
+
+# Time the AI may spend on a move in milliseconds
+AI_MOVETIME = 5000
+
+# Let the AI search on the user's time, starting from the reply it expects
+PONDER = True
+
 # Square constants
 CORNER_RADIUS = 10
 SQUARE_SIZE = 50
@@ -35,6 +46,18 @@ SQUARE_ORIGIN = (
     HEIGHT / 2 - SQUARE_SIZE * 4
 )
 
+# Centers of the buttons
+PLAY_WHITE_CENTER = WIDTH / 2, HEIGHT * 3 / 10
+PLAY_RANDOM_CENTER = WIDTH / 2, HEIGHT / 2
+PLAY_BLACK_CENTER = WIDTH / 2, HEIGHT * 7 / 10
+RESIGN_CENTER = WIDTH / 2, HEIGHT * 11 / 12
+AGAIN_CENTER = WIDTH / 2, HEIGHT - HEIGHT / 12
+
+# Line under the "AI is thinking..." message where the progress
+# of the AI's search is shown
+PROGRESS_CENTER = WIDTH / 2, HEIGHT / 12 + 30
+PROGRESS_RECT = pg.Rect(0, PROGRESS_CENTER[1] - 10, WIDTH, 20)
+
 
 def main():
 
@@ -46,382 +69,455 @@ def main():
     # Font sizes
     label_font = pg.font.Font(BOLD_FONT, 12)
     message_font = pg.font.Font(REGULAR_FONT, 20)
+    progress_font = pg.font.Font(REGULAR_FONT, 12)
+
+    clock = pg.time.Clock()
 
-    # Chess piece icons
+    # Images and text are loaded and rendered once instead of every frame
     icon = {}
     for piece in 'PNBRQKpnbrqk':
         side = 'w' if piece.isupper() else 'b'
         path = os.path.join('assets', 'images', side + piece + '.svg')
         icon[piece] = pg.image.load(path)
+    play_random = pg.image.load(os.path.join('assets', 'images', 'random.png'))
+    resign = pg.image.load(os.path.join('assets', 'images', 'flag.png'))
+
+    messages = {
+        text: message_font.render(text, True, color)
+        for text, color in (
+            ("chess50", WHITE),
+            ("AI is thinking...", WHITE),
+            ("Draw", WHITE),
+            ("You win", WHITE),
+            ("AI wins", WHITE),
+            ("PLAY AGAIN", BLACK),
+        )
+    }
+
+    # Buttons
+    play_white_button = circle_rect(PLAY_WHITE_CENTER, 33)
+    play_random_button = circle_rect(PLAY_RANDOM_CENTER, 50)
+    play_black_button = circle_rect(PLAY_BLACK_CENTER, 33)
+    resign_button = circle_rect(RESIGN_CENTER, 25)
+    again_button = pg.Rect(0, 0, WIDTH / 3, 56)
+    again_button.center = AGAIN_CENTER
 
     # Initialize players
     user = None
-    ai = chess50.ChessAI()
-    ai_turn = False
+    ai = chess50.ChessAI(book=BOOK if os.path.exists(BOOK) else None)
+    search = None
+    ponder = None
+    shown_info = None
 
     # Set up chessboard
     board = chess.Board()
 
     selected_piece = None
+    targets = {}
     pawn_promoted = False
     game_over = False
     user_resigned = False
 
+    # The screen is only drawn again when something on it has changed
+    dirty = True
+
     while True:
 
         # Exit condition
+        click = None
         for event in pg.event.get():
             if event.type == pg.QUIT:
+                if search:
+                    search.cancel()
+                if ponder:
+                    ponder.cancel()
                 pg.quit()
                 sys.exit()
-
-        screen.fill(BLACK)
+            elif event.type == pg.MOUSEBUTTONDOWN and event.button == 1:
+                click = event.pos
+            if event.type != pg.MOUSEMOTION:
+                dirty = True
 
         # Let user choose a side
         if user is None:
 
-            # Game title
-            title = message_font.render("chess50", True, WHITE)
-            title_rect = title.get_rect()
-            title_rect.center = WIDTH / 2, HEIGHT * 11 / 12
-            screen.blit(title, title_rect)
-
-            # Play as White button
-            play_white_button = pg.draw.circle(screen, WHITE, (WIDTH / 2, HEIGHT * 3 / 10), 32)
-            draw_circle(screen, WHITE, (WIDTH / 2, HEIGHT * 3 / 10), 33)
-            play_white = icon['K']
-            play_white_rect = play_white.get_rect()
-            play_white_rect.center = play_white_button.center
-            screen.blit(play_white, play_white_rect)
-
-            # Play as random side button
-            play_random_button = pg.draw.circle(screen, WHITE, (WIDTH / 2, HEIGHT / 2), 49)
-            draw_circle(screen, WHITE, (WIDTH / 2, HEIGHT / 2), 50)
-            play_random = pg.image.load(os.path.join('assets', 'images', 'random.png'))
-            play_random_rect = play_random.get_rect()
-            play_random_rect.center = play_random_button.center
-            screen.blit(play_random, play_random_rect)
-
-            # Play as Black button
-            play_black_button = pg.draw.circle(screen, WHITE, (WIDTH / 2, HEIGHT * 7 / 10), 32)
-            draw_circle(screen, WHITE, (WIDTH / 2, HEIGHT * 7 / 10), 33)
-            play_black = icon['k']
-            play_black_rect = play_black.get_rect()
-            play_black_rect.center = play_black_button.center
-            screen.blit(play_black, play_black_rect)
-
             # Check which Play button was clicked
-            if pg.mouse.get_pressed()[0]:
-                mouse = pg.mouse.get_pos()
-                if play_white_button.collidepoint(mouse):
-                    time.sleep(0.2)
+            if click:
+                if play_white_button.collidepoint(click):
                     user = chess.WHITE
-                elif play_random_button.collidepoint(mouse):
-                    time.sleep(0.2)
+                elif play_random_button.collidepoint(click):
                     user = random.randint(0, 1)
-                elif play_black_button.collidepoint(mouse):
-                    time.sleep(0.2)
+                elif play_black_button.collidepoint(click):
                     user = chess.BLACK
-                termcolor.cprint("If the text is green, the AI thinks it is winning;", 'green')
-                termcolor.cprint("losing if it is red", 'red')
-                print()
-                print("Move  Value")
-
-            # Flip the ranks and files depending on which side is the user
-            if user == chess.WHITE:
-                ranks = chess.RANK_NAMES[::-1]
-                files = chess.FILE_NAMES
-            else:
-                ranks = chess.RANK_NAMES
-                files = chess.FILE_NAMES[::-1]
-
-        else:  # if the game has started
-
-            squares = []
-            occupied = board.piece_map()
-
-            for i, rank in enumerate(ranks):
-                row = []
-                for j, file in enumerate(files):
-
-                    # Squares
-                    square_rect = pg.Rect(
-                        SQUARE_ORIGIN[0] + SQUARE_SIZE * j,
-                        SQUARE_ORIGIN[1] + SQUARE_SIZE * i,
-                        SQUARE_SIZE,
-                        SQUARE_SIZE
-                    )
 
-                    # Draw chessboard with rounded corners
-                    square_color = (
-                        HIGHLIGHT if selected_piece and selected_piece == file + rank else
-                        WHITE if (i + j) % 2 == 0 else
-                        GRAY
-                    )
-                    if i == 0 and j == 0:
-                        pg.draw.rect(
-                            screen,
-                            square_color,
-                            square_rect,
-                            border_top_left_radius=CORNER_RADIUS
-                        )
-                    elif i == 0 and j == 7:
-                        pg.draw.rect(
-                            screen,
-                            square_color,
-                            square_rect,
-                            border_top_right_radius=CORNER_RADIUS
-                        )
-                    elif i == 7 and j == 0:
-                        pg.draw.rect(
-                            screen,
-                            square_color,
-                            square_rect,
-                            border_bottom_left_radius=CORNER_RADIUS
-                        )
-                    elif i == 7 and j == 7:
-                        pg.draw.rect(
-                            screen,
-                            square_color,
-                            square_rect,
-                            border_bottom_right_radius=CORNER_RADIUS
-                        )
+                if user is not None:
+                    termcolor.cprint("If the text is green, the AI thinks it is winning;", 'green')
+                    termcolor.cprint("losing if it is red", 'red')
+                    print()
+                    print("Move  Value")
+
+                    # Flip the ranks and files depending on which side is the user
+                    if user == chess.WHITE:
+                        ranks = chess.RANK_NAMES[::-1]
+                        files = chess.FILE_NAMES
                     else:
-                        pg.draw.rect(
-                            screen,
-                            square_color,
-                            square_rect
-                        )
-
-                    square = chess.parse_square(file + rank)
-
-                    # Show legal moves visually after selecting a piece to move
-                    if selected_piece:
-                        if not selected_piece == file + rank:
-                            try:
-                                move = board.find_move(
-                                    chess.parse_square(selected_piece),
-                                    chess.parse_square(file + rank)
-                                )
-
-                                if move in board.legal_moves:
-
-                                    # Legal moves to empty squares
-                                    if square not in occupied:
-                                        draw_circle(screen, HIGHLIGHT, square_rect.center, 7)
-
-                                    # Pieces that can be captured and rooks in castling
-                                    else:
-                                        pg.draw.rect(screen, HIGHLIGHT, square_rect)
-                                        pg.draw.rect(
-                                            screen,
-                                            WHITE if (i + j) % 2 == 0 else GRAY,
-                                            square_rect,
-                                            border_radius=15
-                                        )
-                            except ValueError:
-                                pass
-
-                    # Rank and file names
-                    if j == 0:
-                        rank_name = label_font.render(
-                            rank, True,
-                            GRAY if (i + j) % 2 == 0 else WHITE
-                        )
-                        rank_name_rect = rank_name.get_rect()
-                        rank_name_rect.center = (
-                            square_rect[0] + SQUARE_SIZE / 8,
-                            square_rect[1] + SQUARE_SIZE / 5
-                        )
-                        screen.blit(rank_name, rank_name_rect)
-
-                    if i == 7:
-                        file_name = label_font.render(
-                            file, True,
-                            GRAY if (i + j) % 2 == 0 else WHITE
-                        )
-                        file_name_rect = file_name.get_rect()
-                        file_name_rect.center = (
-                            square_rect[0] + SQUARE_SIZE / 8,
-                            square_rect[1] + SQUARE_SIZE * 4 / 5,
-                        )
-                        screen.blit(file_name, file_name_rect)
-
-                    # Chess pieces
-                    if square in occupied:
-                        piece = occupied[square].symbol()
-                        piece = icon[piece]
-                        pieceRect = piece.get_rect()
-                        pieceRect.center = square_rect.center
-                        screen.blit(piece, pieceRect)
-
-                    row.append(square_rect)
-
-                squares.append(row)
-
-            if not game_over:  # yet
-
-                # If AI's turn
-                if not board.turn == user:
-
-                    # AI is thinking of a move
-                    ai_thinking = message_font.render("AI is thinking...", True, WHITE)
-                    ai_thinking_rect = ai_thinking.get_rect()
-                    ai_thinking_rect.center = WIDTH / 2, HEIGHT / 12
-                    screen.blit(ai_thinking, ai_thinking_rect)
-
-                    if ai_turn:
-
-                        time.sleep(0.5)
-
-                        value, move = ai.minimax(board)
-                        termcolor.cprint(
-                            f"{move}  {value}",
-                            'green' if (board.turn == chess.WHITE and value > 0) or (board.turn == chess.BLACK and value < 0) else
-                            'white' if not value else
-                            'red'
-                        )
-                        board.push(move)
-
-                        ai_turn = False
+                        ranks = chess.RANK_NAMES
+                        files = chess.FILE_NAMES[::-1]
 
+                    squares = square_rects(ranks, files)
+                    chessboard = render_board(ranks, files)
+                    labels = render_labels(label_font, ranks, files)
+
+        elif not game_over:  # yet
+
+            # User can resign on either side's turn, which stops the AI's search
+            if click and resign_button.collidepoint(click):
+                user_resigned = True
+                click = None
+
+            # If AI's turn
+            if not board.turn == user:
+
+                # Search in the background so the window stays responsive,
+                # continuing from what was found while pondering, if anything
+                if search is None:
+                    if ponder:
+                        search = ponder.respond(board, AI_MOVETIME)
+                        ponder = None
                     else:
-                        ai_turn = True
+                        search = chess50.BackgroundSearch(ai, board, movetime=AI_MOVETIME)
+                    shown_info = None
+
+                elif search.done():
+
+                    value, move = search.result
+                    termcolor.cprint(
+                        f"{move}  {value}",
+                        'green' if (board.turn == chess.WHITE and value > 0) or (board.turn == chess.BLACK and value < 0) else
+                        'white' if not value else
+                        'red'
+                    )
+                    board.push(move)
+
+                    # Ponder on the reply the search expects from the user
+                    if PONDER and not board.is_game_over():
+                        pv = search.info['pv'] if search.info else []
+                        guess = pv[1] if len(pv) > 1 and pv[0] == move else None
+                        ponder = chess50.PonderSearch(ai, board, guess)
+
+                    search = None
+                    dirty = True
 
-                else:  # if user's turn
+            else:  # if user's turn
+
+                # Handle pawn promotion
+                if pawn_promoted and click:
+
+                    for i, symbol in enumerate('QRBN' if user == chess.WHITE else 'qrbn'):
+                        if circle_rect((SQUARE_SIZE*2*(i+1), 50), 33).collidepoint(click):
+                            board.push_san(move.uci()[:4] + symbol.lower())
+                            pawn_promoted = False
 
-                    # Handle pawn promotion
                     if pawn_promoted:
+                        selected_piece = None
+                        pawn_promoted = False
 
-                        options = {}
+                    click = None
 
-                        for i, symbol in enumerate('QRBN' if user == chess.WHITE else 'qrbn'):
-                            option_button = pg.draw.circle(screen, WHITE, (SQUARE_SIZE*2*(i+1), 50), 32)
-                            draw_circle(screen, WHITE, (SQUARE_SIZE*2*(i+1), 50), 33)
-                            option = icon[symbol]
-                            option_rect = option.get_rect()
-                            option_rect.center = option_button.center
-                            screen.blit(option, option_rect)
-                            options[symbol] = option_button
-
-                        if pg.mouse.get_pressed()[0]:
-
-                            for symbol in ('QRBN' if user == chess.WHITE else 'qrbn'):
-                                if options[symbol].collidepoint(pg.mouse.get_pos()):
-                                    time.sleep(0.2)
-                                    board.push_san(move.uci()[:4] + symbol.lower())
-                                    pawn_promoted = False
-
-                            if pawn_promoted:
+                # If user clicked one of the squares
+                if click:
+                    square = next(
+                        (square for square, rect in squares.items() if rect.collidepoint(click)),
+                        None
+                    )
+
+                    if square is not None:
+
+                        # and one of user's pieces is on that square
+                        if board.color_at(square) == user:
+
+                            # If user has already selected a piece
+                            # and clicked that piece again
+                            if square == selected_piece:
                                 selected_piece = None
-                                pawn_promoted = False
-
-                    resign_button = pg.draw.circle(screen, WHITE, (WIDTH / 2, HEIGHT * 11 / 12), 24)
-                    draw_circle(screen, WHITE, (WIDTH / 2, HEIGHT * 11 / 12), 25)
-                    draw_circle(screen, BLACK, (WIDTH / 2, HEIGHT * 11 / 12), 22)
-                    resign = pg.image.load(os.path.join('assets', 'images', 'flag.png'))
-                    resign_rect = resign.get_rect()
-                    resign_rect.center = WIDTH / 2 + 2, HEIGHT * 11 / 12 + 1
-                    screen.blit(resign, resign_rect)
-
-                    if pg.mouse.get_pressed()[0]:
-                        if resign_button.collidepoint(pg.mouse.get_pos()):
-                            time.sleep(0.2)
-                            user_resigned = True
-
-                    user_pieces = {
-                        square
-                        for square, piece in occupied.items()
-                        if piece.color == user
-                    }
-
-                    # If user has clicked somewhere on the screen
-                    if not pawn_promoted:
-                        if pg.mouse.get_pressed()[0]:
-
-                            for i, rank in enumerate(ranks):
-                                for j, file in enumerate(files):
-
-                                    # If user clicked one of the squares
-                                    if squares[i][j].collidepoint(pg.mouse.get_pos()):
-
-                                        time.sleep(0.2)
-
-                                        # and one of user's pieces is on that square
-                                        if chess.parse_square(file + rank) in user_pieces:
-
-                                            # If user has already selected a piece
-                                            # and clicked that piece again
-                                            if selected_piece and file + rank == selected_piece:
-                                                selected_piece = None
-
-                                            # If user hasn't selected a piece to move yet
-                                            else:
-                                                selected_piece = file + rank
-
-                                        # Else if a piece has already been chosen
-                                        # and it's not another of user's pieces
-                                        elif selected_piece:
-
-                                            try:
-                                                # Find a legal move
-                                                move = board.find_move(
-                                                    chess.parse_square(selected_piece),
-                                                    chess.parse_square(file + rank)
-                                                )
-                                                # If move is not a pawn promotion
-                                                if len(move.uci()) < 5:
-                                                    board.push(move)
-                                                else:
-                                                    pawn_promoted = True
-                                            except ValueError:
-                                                pass
-                                            selected_piece = None
-
-            else:  # if the game is over
-
-                result = (
-                    "Draw" if winner == None else
-                    "You win" if winner == user else
-                    "AI wins"
-                )
-                result = message_font.render(result, True, WHITE)
-                result_rect = result.get_rect()
-                result_rect.center = WIDTH / 2, HEIGHT / 12
-                screen.blit(result, result_rect)
-
-                # Draw Play Again button
-                again_button = pg.Rect(WIDTH / 2, HEIGHT / 2, WIDTH / 3, 56)
-                again_button.center = WIDTH / 2, HEIGHT - HEIGHT / 12
-                pg.draw.rect(screen, WHITE, again_button, border_radius=CORNER_RADIUS)
-
-                again = message_font.render("PLAY AGAIN", True, BLACK)
-                again_rect = again.get_rect()
-                again_rect.center = again_button.center
-                screen.blit(again, again_rect)
-
-                if pg.mouse.get_pressed()[0]:
-                    if again_button.collidepoint(pg.mouse.get_pos()):
-                        time.sleep(0.2)
-                        board.reset()
-                        user = None
-                        ai_turn = False
-                        game_over = False
-                        selected_piece = False
-                        pawn_promoted = False
-                        user_resigned = False
+
+                            # If user hasn't selected a piece to move yet,
+                            # remember where it can move until it is moved
+                            else:
+                                selected_piece = square
+                                targets = legal_targets(board, square)
+
+                        # Else if a piece has already been chosen
+                        # and it's not another of user's pieces
+                        elif selected_piece is not None:
+
+                            if square in targets:
+                                move = targets[square]
+
+                                # If move is not a pawn promotion
+                                if not move.promotion:
+                                    board.push(move)
+                                else:
+                                    pawn_promoted = True
+                            selected_piece = None
+
+        else:  # if the game is over
+
+            if click and again_button.collidepoint(click):
+                board.reset()
+                ai.table.clear()
+                user = None
+                game_over = False
+                selected_piece = None
+                pawn_promoted = False
+                user_resigned = False
 
         # User resigns
         if user_resigned:
-            selected_piece = False
+            if search:
+                search.cancel()
+                search = None
+            if ponder:
+                ponder.cancel()
+                ponder = None
+            selected_piece = None
             game_over = True
             winner = not user
 
         # Game is over not due to user resigning
         elif game_over := board.outcome():
             winner = game_over.winner
+            if ponder:
+                ponder.cancel()
+                ponder = None
+
+        if dirty:
+
+            screen.fill(BLACK)
+
+            if user is None:
+
+                # Game title
+                blit_centered(screen, messages["chess50"], (WIDTH / 2, HEIGHT * 11 / 12))
 
-        pg.display.flip()
+                # Play as White, random side and Black buttons
+                draw_button(screen, icon['K'], PLAY_WHITE_CENTER, 33)
+                draw_button(screen, play_random, PLAY_RANDOM_CENTER, 50)
+                draw_button(screen, icon['k'], PLAY_BLACK_CENTER, 33)
+
+            else:  # if the game has started
+
+                draw_chessboard(
+                    screen, board, icon, chessboard, labels, squares,
+                    selected_piece, targets if selected_piece is not None else {}
+                )
+
+                if game_over:
+
+                    result = (
+                        "Draw" if winner == None else
+                        "You win" if winner == user else
+                        "AI wins"
+                    )
+                    blit_centered(screen, messages[result], (WIDTH / 2, HEIGHT / 12))
+
+                    # Draw Play Again button
+                    pg.draw.rect(screen, WHITE, again_button, border_radius=CORNER_RADIUS)
+                    blit_centered(screen, messages["PLAY AGAIN"], again_button.center)
+
+                else:
+
+                    if not board.turn == user:
+
+                        # AI is thinking of a move
+                        blit_centered(screen, messages["AI is thinking..."], (WIDTH / 2, HEIGHT / 12))
+                        shown_info = None
+
+                    elif pawn_promoted:
+                        for i, symbol in enumerate('QRBN' if user == chess.WHITE else 'qrbn'):
+                            draw_button(screen, icon[symbol], (SQUARE_SIZE*2*(i+1), 50), 33)
+
+                    # Resign button
+                    draw_circle(screen, WHITE, RESIGN_CENTER, 25)
+                    draw_circle(screen, BLACK, RESIGN_CENTER, 22)
+                    blit_centered(screen, resign, (RESIGN_CENTER[0] + 2, RESIGN_CENTER[1] + 1))
+
+            pg.display.flip()
+            dirty = False
+
+        # Show the progress of the search, only updating its own area
+        if search and (info := search.info) and info is not shown_info:
+            shown_info = info
+            progress = progress_font.render(
+                f"Depth {info['depth']}  {info['move']}  {info['nps']} nodes/s",
+                True, GRAY
+            )
+            screen.fill(BLACK, PROGRESS_RECT)
+            blit_centered(screen, progress, PROGRESS_CENTER)
+            pg.display.update(PROGRESS_RECT)
+
+        clock.tick(FPS)
+
+
+def square_rects(ranks, files):
+    """
+    Returns the rectangle of every square on the screen
+    """
+    return {
+        chess.parse_square(file + rank): pg.Rect(
+            SQUARE_ORIGIN[0] + SQUARE_SIZE * j,
+            SQUARE_ORIGIN[1] + SQUARE_SIZE * i,
+            SQUARE_SIZE,
+            SQUARE_SIZE
+        )
+        for i, rank in enumerate(ranks)
+        for j, file in enumerate(files)
+    }
+
+
+def square_color(square):
+    """
+    Returns the color of a square
+    """
+    return GRAY if chess.BB_SQUARES[square] & chess.BB_DARK_SQUARES else WHITE
+
+
+def draw_square(surface, color, rect, i, j):
+    """
+    Draws the square in row i and column j of the chessboard,
+    with rounded corners at the corners of the chessboard
+    """
+    pg.draw.rect(
+        surface,
+        color,
+        rect,
+        border_top_left_radius=CORNER_RADIUS if i == 0 and j == 0 else -1,
+        border_top_right_radius=CORNER_RADIUS if i == 0 and j == 7 else -1,
+        border_bottom_left_radius=CORNER_RADIUS if i == 7 and j == 0 else -1,
+        border_bottom_right_radius=CORNER_RADIUS if i == 7 and j == 7 else -1,
+    )
+
+
+def render_board(ranks, files):
+    """
+    Draws the empty chessboard once, on a surface the size of the screen
+    """
+    surface = pg.Surface(SIZE, pg.SRCALPHA)
+
+    squares = square_rects(ranks, files)
+    for i, rank in enumerate(ranks):
+        for j, file in enumerate(files):
+            square = chess.parse_square(file + rank)
+            draw_square(surface, square_color(square), squares[square], i, j)
+
+    return surface
+
+
+def render_labels(font, ranks, files):
+    """
+    Draws the rank and file names once, on a transparent surface
+    the size of the screen
+    """
+    surface = pg.Surface(SIZE, pg.SRCALPHA)
+
+    squares = square_rects(ranks, files)
+    for i, rank in enumerate(ranks):
+        for j, file in enumerate(files):
+            square = chess.parse_square(file + rank)
+            color = WHITE if square_color(square) == GRAY else GRAY
+            x, y = squares[square].topleft
+
+            # Rank and file names
+            if j == 0:
+                blit_centered(surface, font.render(rank, True, color), (
+                    x + SQUARE_SIZE / 8,
+                    y + SQUARE_SIZE / 5
+                ))
+            if i == 7:
+                blit_centered(surface, font.render(file, True, color), (
+                    x + SQUARE_SIZE / 8,
+                    y + SQUARE_SIZE * 4 / 5
+                ))
+
+    return surface
+
+
+def legal_targets(board, square):
+    """
+    Returns the legal moves of the piece on a square by their destination,
+    with promotions to a queen standing for every promotion
+    """
+    targets = {}
+    for move in board.generate_legal_moves(chess.BB_SQUARES[square]):
+        if move.promotion in (None, chess.QUEEN):
+            targets[move.to_square] = move
+
+        # Castling can also be chosen by clicking the rook
+        if board.is_castling(move):
+            rank = chess.square_rank(move.from_square)
+            file = 7 if chess.square_file(move.to_square) > chess.square_file(move.from_square) else 0
+            targets[chess.square(file, rank)] = move
+
+    return targets
+
+
+def draw_chessboard(screen, board, icon, chessboard, labels, squares, selected_piece, targets):
+    """
+    Draws the chessboard, the selected piece and the moves it can make,
+    and the pieces
+    """
+    screen.blit(chessboard, (0, 0))
+
+    # Show legal moves visually after selecting a piece to move
+    if selected_piece is not None:
+        rect = squares[selected_piece]
+        i = int((rect.y - SQUARE_ORIGIN[1]) // SQUARE_SIZE)
+        j = int((rect.x - SQUARE_ORIGIN[0]) // SQUARE_SIZE)
+        draw_square(screen, HIGHLIGHT, rect, i, j)
+
+    for square in targets:
+        rect = squares[square]
+
+        # Legal moves to empty squares
+        if board.piece_type_at(square) is None:
+            draw_circle(screen, HIGHLIGHT, rect.center, 7)
+
+        # Pieces that can be captured and rooks in castling
+        else:
+            pg.draw.rect(screen, HIGHLIGHT, rect)
+            pg.draw.rect(screen, square_color(square), rect, border_radius=15)
+
+    screen.blit(labels, (0, 0))
+
+    # Chess pieces
+    for square, piece in board.piece_map().items():
+        blit_centered(screen, icon[piece.symbol()], squares[square].center)
+
+
+def draw_button(surface, image, center, radius):
+    """
+    Draws a round button with an image in its middle
+    """
+    draw_circle(surface, WHITE, center, radius)
+    blit_centered(surface, image, center)
+
+
+def circle_rect(center, radius):
+    """
+    Returns the rectangle around a circle, where clicks on it are detected
+    """
+    rect = pg.Rect(0, 0, radius * 2, radius * 2)
+    rect.center = center
+    return rect
+
+
+def blit_centered(surface, image, center):
+    """
+    Draws an image centered on a point
+    """
+    rect = image.get_rect()
+    rect.center = center
+    surface.blit(image, rect)
 
 
 def draw_circle(surface, color, center, radius):
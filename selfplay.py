@@ -0,0 +1,207 @@
+"""
+Play two configurations of the chess AI against each other
+"""
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import time
+
+# niklasf/python-chess is licensed under GPL-3.0
+import chess
+import chess.pgn
+
+import chess50
+
+# Openings played when no file of starting positions is given
+OPENINGS = [
+    'e2e4 e7e5 g1f3 b8c6 f1b5',
+    'e2e4 e7e5 g1f3 b8c6 f1c4',
+    'e2e4 c7c5 g1f3 d7d6 d2d4',
+    'e2e4 e7e6 d2d4 d7d5',
+    'e2e4 c7c6 d2d4 d7d5',
+    'd2d4 d7d5 c2c4 e7e6',
+    'd2d4 d7d5 c2c4 c7c6',
+    'd2d4 g8f6 c2c4 g7g6 b1c3',
+    'd2d4 g8f6 c2c4 e7e6 b1c3 f8b4',
+    'c2c4 e7e5 b1c3 g8f6',
+    'g1f3 d7d5 g2g3 g8f6',
+    'e2e4 d7d5 e4d5 d8d5',
+]
+
+# Games still going after this many plies are scored as draws
+MAX_PLIES = 300
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--games', type=int, default=100, help="number of games to play")
+    parser.add_argument('--movetime', type=int, default=200, help="milliseconds per move")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="games played at once")
+    parser.add_argument('--engine1', default='{}', help="ChessAI options of the first engine as JSON")
+    parser.add_argument('--engine2', default='{}', help="ChessAI options of the second engine as JSON")
+    parser.add_argument('--openings', help="file of starting positions, one FEN or EPD per line")
+    parser.add_argument('--pgn', help="file to append the games to")
+    parser.add_argument('--jsonl', help="file to append the game results to")
+    args = parser.parse_args()
+
+    engines = [json.loads(args.engine1), json.loads(args.engine2)]
+    openings = load_openings(args.openings) if args.openings else [
+        opening_fen(moves) for moves in OPENINGS
+    ]
+
+    # Each opening is played twice, with the engines swapping colors
+    games = [
+        (game, openings[game // 2 % len(openings)], game % 2, engines, args.movetime)
+        for game in range(args.games)
+    ]
+
+    pgn_file = open(args.pgn, 'a') if args.pgn else None
+    jsonl_file = open(args.jsonl, 'a') if args.jsonl else None
+
+    # Wins, draws and losses of the first engine
+    score = [0, 0, 0]
+
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+        for future in concurrent.futures.as_completed([pool.submit(play, *game) for game in games]):
+            record, pgn = future.result()
+
+            points = record['points']
+            score[0 if points == 1 else 1 if points == 0.5 else 2] += 1
+
+            if pgn_file:
+                print(pgn, file=pgn_file, end='\n\n', flush=True)
+            if jsonl_file:
+                print(json.dumps(record), file=jsonl_file, flush=True)
+
+            print(
+                f"Game {record['game'] + 1:>4}  {record['result']:<7}  "
+                f"+{score[0]} ={score[1]} -{score[2]}  {elo_summary(*score)}"
+            )
+
+    for file in (pgn_file, jsonl_file):
+        if file:
+            file.close()
+
+
+def play(game, fen, swapped, engines, movetime):
+    """
+    Plays one game from a starting position, returning its result
+    and its PGN
+    """
+    board = chess.Board(fen)
+
+    # The first engine plays White unless the colors are swapped
+    players = [chess50.ChessAI(**options) for options in engines]
+    if swapped:
+        players.reverse()
+    white, black = players
+    names = ['engine1', 'engine2'][::-1 if swapped else 1]
+
+    overruns = 0
+    started = time.monotonic()
+
+    while not (outcome := board.outcome(claim_draw=True)) and board.ply() < MAX_PLIES:
+        ai = white if board.turn == chess.WHITE else black
+
+        thinking = time.monotonic()
+        _, move = ai.search(board, movetime=movetime)
+        if (time.monotonic() - thinking) * 1000 > movetime * 1.5:
+            overruns += 1
+
+        board.push(move)
+
+    result = outcome.result() if outcome else '1/2-1/2'
+    termination = outcome.termination.name.lower() if outcome else 'max_plies'
+
+    pgn = chess.pgn.Game.from_board(board)
+    pgn.headers['Event'] = 'chess50 self-play'
+    pgn.headers['Round'] = str(game + 1)
+    pgn.headers['White'], pgn.headers['Black'] = names
+    pgn.headers['Result'] = result
+    pgn.headers['Termination'] = termination
+
+    # Points of the first engine
+    points = {'1-0': 1, '0-1': 0}.get(result, 0.5)
+    if swapped:
+        points = 1 - points
+
+    record = {
+        'game': game,
+        'fen': fen,
+        'white': names[0],
+        'black': names[1],
+        'result': result,
+        'termination': termination,
+        'points': points,
+        'plies': len(board.move_stack),
+        'overruns': overruns,
+        'seconds': round(time.monotonic() - started, 2),
+    }
+
+    return record, str(pgn)
+
+
+def load_openings(path):
+    """
+    Returns the FENs of the starting positions in a file of FENs or EPDs
+    """
+    openings = []
+    with open(path) as file:
+        for line in file:
+            if line := line.strip():
+                try:
+                    board = chess.Board(line)
+                except ValueError:
+                    board, _ = chess.Board.from_epd(line)
+                openings.append(board.fen())
+
+    return openings
+
+
+def opening_fen(moves):
+    """
+    Returns the FEN of the position after a sequence of UCI moves
+    """
+    board = chess.Board()
+    for move in moves.split():
+        board.push_uci(move)
+
+    return board.fen()
+
+
+def elo_summary(wins, draws, losses):
+    """
+    Returns the Elo difference of the first engine implied by its score,
+    with a 95% confidence interval
+    """
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+
+    # Standard error of the mean score of a game
+    variance = (
+        wins * (1 - score) ** 2 +
+        draws * (0.5 - score) ** 2 +
+        losses * (0 - score) ** 2
+    ) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    elo = elo_difference(score)
+    low = elo_difference(score - margin)
+    high = elo_difference(score + margin)
+
+    return f"Elo {elo:+.0f} [{low:+.0f}, {high:+.0f}]"
+
+
+def elo_difference(score):
+    """
+    Converts a mean score between 0 and 1 to an Elo difference
+    """
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""
+Serve the chess AI's analysis of positions over HTTP, on a local port or socket
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import time
+
+# niklasf/python-chess is licensed under GPL-3.0
+import chess
+
+import chess50
+import worker
+
+HOST = '127.0.0.1'
+PORT = 8050
+
+# Milliseconds searched when a request gives neither a depth nor a time,
+# and the longest time a request may ask for
+MOVETIME = 1000
+MAX_MOVETIME = 60000
+
+# Most requests sent to a worker process at once
+BATCH_SIZE = 8
+
+# Number of recent requests the latency percentiles are taken over
+LATENCY_WINDOW = 1000
+
+# Largest request body read, in bytes
+MAX_BODY = 1 << 20
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default=HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=PORT, help="port to listen on")
+    parser.add_argument('--unix', help="Unix socket to listen on instead of a port")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of search processes")
+    parser.add_argument('--table-mb', type=int, default=chess50.TABLE_SIZE_MB, help="size of the shared hash table")
+    parser.add_argument('--cache', help="SQLite file of search results shared by the workers and kept between runs")
+    parser.add_argument('--engine', default='{}', help="ChessAI options of the workers as JSON")
+    parser.add_argument('--movetime', type=int, default=MOVETIME, help="default milliseconds per position")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="most positions sent to a worker at once")
+    args = parser.parse_args()
+
+    server = AnalysisServer(
+        args.workers,
+        args.table_mb,
+        args.cache,
+        json.loads(args.engine),
+        args.movetime,
+        args.batch_size
+    )
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+class AnalysisServer():
+    """
+    Answers HTTP requests to analyse positions with a pool of worker
+    processes, each keeping one ChessAI between requests
+
+    Requests wait in a queue from which each worker takes a batch at a time.
+    The workers share one transposition table in shared memory and, if
+    given, one position cache on disk
+
+    POST /analyse takes {"fen": ..., "depth": ..., "movetime": ...}, or
+    {"positions": [...]} of several of those, and GET /metrics returns
+    the queue depth, throughput and latency
+    """
+
+    def __init__(self, workers, table_mb, cache, options, movetime, batch_size):
+        self.workers = workers
+        self.movetime = movetime
+        self.batch_size = batch_size
+
+        # Created with the event loop by serve
+        self.queue = None
+
+        self.buffer = multiprocessing.RawArray('B', 16 * chess50.table_slots(table_mb))
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            workers,
+            initializer=worker.start_worker,
+            initargs=(self.buffer, table_mb, {**options, 'cache': cache})
+        )
+
+        self.started = time.monotonic()
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self.nodes = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.waits = collections.deque(maxlen=LATENCY_WINDOW)
+
+    async def serve(self, host, port, unix=None):
+        """
+        Accepts connections until cancelled, with one dispatcher task
+        feeding each worker process
+        """
+        self.queue = asyncio.Queue()
+        dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, unix)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on {unix or f'http://{host}:{port}'} with {self.workers} workers", flush=True)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for dispatcher in dispatchers:
+                dispatcher.cancel()
+
+    async def handle(self, reader, writer):
+        """
+        Reads one HTTP request from a connection and writes its response
+        """
+        try:
+            method, path, body = await read_request(reader)
+            status, payload = await self.route(method, path, body)
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            status, payload = 400, {'error': str(error)}
+        except Exception as error:
+            status, payload = 500, {'error': repr(error)}
+
+        data = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        """
+        Returns the status and JSON payload of the response to a request
+        """
+        path = path.split('?')[0].rstrip('/')
+
+        if path == '/analyse':
+            if method != 'POST':
+                return 405, {'error': "use POST"}
+            request = json.loads(body or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("the request must be a JSON object")
+            if 'positions' in request:
+                if not isinstance(request['positions'], list):
+                    raise ValueError("positions must be a list")
+                results = await asyncio.gather(*(
+                    self.analyse(position) for position in request['positions']
+                ))
+                return 200, {'results': results}
+            return 200, await self.analyse(request)
+
+        if path == '/metrics':
+            return 200, self.metrics()
+
+        return 404, {'error': f"no such path {path}"}
+
+    async def analyse(self, request):
+        """
+        Queues a position for analysis and returns its result once
+        a worker has searched it
+        """
+        if not isinstance(request, dict):
+            raise ValueError("each position must be a JSON object")
+        fen = request.get('fen', chess.STARTING_FEN)
+        chess.Board(fen)
+
+        depth = min(int(request.get('depth', chess50.MAX_SEARCH_DEPTH)), chess50.MAX_SEARCH_DEPTH)
+        movetime = request.get('movetime')
+        if movetime is None and 'depth' not in request:
+            movetime = self.movetime
+        if movetime is not None:
+            movetime = min(max(1, int(movetime)), MAX_MOVETIME)
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((fen, depth, movetime), future, time.monotonic()))
+        return await future
+
+    async def dispatch(self):
+        """
+        Sends batches of queued requests to a worker process one after
+        another, taking a fair share of the queue each time so that
+        idle workers are not left waiting
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            jobs = [await self.queue.get()]
+            share = math.ceil((self.queue.qsize() + 1) / self.workers)
+            while len(jobs) < min(share, self.batch_size) and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+
+            sent = time.monotonic()
+            self.busy += 1
+            self.batches += 1
+            try:
+                results = await loop.run_in_executor(
+                    self.pool, analyse_batch, [request for request, _, _ in jobs]
+                )
+            except Exception as error:
+                self.failed += len(jobs)
+                for _, future, _ in jobs:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            finally:
+                self.busy -= 1
+
+            finished = time.monotonic()
+            for (_, future, queued), result in zip(jobs, results):
+                self.completed += 1
+                self.nodes += result['nodes']
+                self.waits.append(sent - queued)
+                self.latencies.append(finished - queued)
+                result['queue_ms'] = round((sent - queued) * 1000, 1)
+                if not future.done():
+                    future.set_result(result)
+
+    def metrics(self):
+        """
+        Returns the state of the queue and workers and the throughput
+        and latency of recent requests
+        """
+        uptime = time.monotonic() - self.started
+        return {
+            'uptime': round(uptime, 1),
+            'workers': self.workers,
+            'busy_workers': self.busy,
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'completed': self.completed,
+            'failed': self.failed,
+            'batches': self.batches,
+            'requests_per_second': round(self.completed / uptime, 2) if uptime else 0,
+            'nodes': self.nodes,
+            'latency_ms': percentiles(self.latencies),
+            'queue_wait_ms': percentiles(self.waits),
+        }
+
+    def close(self):
+        """
+        Shuts down the worker processes
+        """
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def read_request(reader):
+    """
+    Returns the method, path and body of an HTTP request
+    """
+    line = await reader.readline()
+    try:
+        method, path, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise ValueError("malformed request line") from None
+
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise ValueError("request body is too large")
+    body = await reader.readexactly(length) if length else b''
+
+    return method, path, body
+
+
+def percentiles(seconds):
+    """
+    Returns the median, 95th and 99th percentiles and the maximum
+    of some durations in milliseconds
+    """
+    if not seconds:
+        return {'p50': 0, 'p95': 0, 'p99': 0, 'max': 0}
+
+    ordered = sorted(seconds)
+    at = lambda fraction: round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+    return {'p50': at(0.5), 'p95': at(0.95), 'p99': at(0.99), 'max': round(ordered[-1] * 1000, 1)}
+
+
+def analyse_batch(requests):
+    """
+    Searches a batch of (FEN, depth, movetime) requests in a worker process,
+    returning the value, best move, principal variation, depth reached,
+    nodes and time of each
+    """
+    results = []
+    ai = worker.worker_ai
+
+    for fen, depth, movetime in requests:
+        board = chess.Board(fen)
+        info = {'depth': 0, 'pv': []}
+
+        started = time.monotonic()
+        value, move = ai.search(board, movetime=movetime, depth=depth, callback=info.update)
+
+        results.append({
+            'fen': fen,
+            'value': value,
+            'move': move.uci() if move else None,
+            'pv': [move.uci() for move in info['pv']],
+            'depth': info['depth'],
+            'nodes': ai.nodes,
+            'time_ms': round((time.monotonic() - started) * 1000, 1),
+        })
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
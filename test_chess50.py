@@ -0,0 +1,192 @@
+"""
+Tests of the chess AI's move generation, hashing and search, run with pytest
+"""
+import random
+
+import pytest
+
+# niklasf/python-chess is licensed under GPL-3.0
+import chess
+import chess.polyglot
+
+import chess50
+
+# Positions the random games start from, with castling, en passant
+# and promotions to be played early on
+START_FENS = [
+    chess.STARTING_FEN,
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3',
+    'n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1',
+    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+]
+
+# Random games played from each position and their longest length in plies
+GAMES = 20
+PLIES = 80
+
+# Checkmates of each side and checks that are not checkmate, which the
+# random games rarely reach
+CHECK_FENS = [
+    'r1bqkb1r/pppp1Qpp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 0 4',
+    'rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3',
+    'R5k1/5ppp/8/8/8/8/8/6K1 b - - 1 1',
+    'R5k1/5pp1/7p/8/8/8/8/6K1 b - - 1 2',
+    '4k3/8/8/8/8/8/8/4K2r w - - 0 1',
+]
+
+# Standard perft positions, a depth small enough to check them quickly at
+# and the number of positions that many moves from each
+PERFT_POSITIONS = [
+    (chess.STARTING_FEN, 3, 8902),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 2, 2039),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', 3, 2812),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', 2, 264),
+    ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', 2, 1486),
+    ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10', 2, 2079),
+]
+
+
+def special(board, move):
+    """
+    Returns the kind of move it is if it changes the hash in a special way
+    """
+    if not move:
+        return 'null'
+    if board.is_castling(move):
+        return 'castling'
+    if board.is_en_passant(move):
+        return 'en passant'
+    if move.promotion:
+        return 'promotion'
+    return None
+
+
+def play_random_games(ai, rng):
+    """
+    Plays random games with the AI's push and pop, taking moves back now
+    and then, and yields the board after every push and pop along with
+    the kind of move just made, if special
+    """
+    for fen in START_FENS:
+        for _ in range(GAMES):
+            board = chess.Board(fen)
+            ai.start(board)
+
+            for _ in range(PLIES):
+                if ai.hashes and rng.random() < 0.2:
+                    ai.pop(board)
+                    yield board, None
+                    continue
+
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+
+                # Special moves are preferred so that every game has some
+                specials = [move for move in moves if special(board, move)]
+                if specials and rng.random() < 0.5:
+                    move = rng.choice(specials)
+                elif not board.is_check() and rng.random() < 0.1:
+                    move = chess.Move.null()
+                else:
+                    move = rng.choice(moves)
+
+                kind = special(board, move)
+                ai.push(board, move)
+                yield board, kind
+
+
+def test_incremental_hash_matches_polyglot():
+    ai = chess50.ChessAI(table_mb=1)
+    kinds = set()
+
+    for board, kind in play_random_games(ai, random.Random(0)):
+        expected = chess.polyglot.zobrist_hash(board)
+        assert ai.zobrist_hash(board) == expected, board.fen()
+        assert ai.hash == expected, board.fen()
+        kinds.add(kind)
+
+    assert kinds >= {'null', 'castling', 'en passant', 'promotion'}
+
+
+def test_seeded_keys_are_reproducible():
+    first = chess50.ChessAI(seed=1, table_mb=1)
+    again = chess50.ChessAI(seed=1, table_mb=1)
+    other = chess50.ChessAI(seed=2, table_mb=1)
+
+    assert first.zobrist == again.zobrist
+    assert first.zobrist != other.zobrist
+    assert first.zobrist != chess50.ChessAI(table_mb=1).zobrist
+
+    # Seeded keys are updated incrementally the same way as Polyglot's
+    for board, _ in play_random_games(first, random.Random(1)):
+        assert first.hash == first.zobrist_hash(board) == again.zobrist_hash(board), board.fen()
+
+
+def test_utility_batch_matches_utility():
+    pytest.importorskip('numpy')
+    ai = chess50.ChessAI(table_mb=1)
+
+    # More boards than fit in one batch
+    boards = [chess.Board(fen) for fen in CHECK_FENS]
+    boards += [board.copy(stack=False) for board, _ in play_random_games(ai, random.Random(2))]
+    assert len(boards) > chess50.BATCH_SIZE
+    assert sum(board.is_checkmate() for board in boards) >= 3
+
+    expected = [ai.utility(board) for board in boards]
+    assert list(ai.utility_batch(boards)) == expected
+    assert list(ai.utility_batch(board.fen() for board in boards)) == expected
+    assert len(ai.utility_batch([])) == 0
+
+
+@pytest.mark.parametrize('fen, depth, expected', PERFT_POSITIONS)
+def test_perft(fen, depth, expected):
+    ai = chess50.ChessAI(table_mb=1)
+
+    # Without validation the last ply is counted without making its moves
+    assert ai.perft(chess.Board(fen), depth) == expected
+    assert ai.perft(chess.Board(fen), depth, validate=True) == expected
+
+
+def test_mate_on_the_hundredth_half_move_is_not_a_draw():
+    ai = chess50.ChessAI(table_mb=1)
+    value, move = ai.search(chess.Board('6k1/5ppp/8/8/8/8/8/R5K1 w - - 99 80'), depth=4)
+
+    assert move == chess.Move.from_uci('a1a8')
+    assert value >= chess50.CHECKMATE_VALUE
+
+
+def test_stalemate_is_a_draw():
+    ai = chess50.ChessAI(table_mb=1)
+
+    assert ai.search(chess.Board('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1'), depth=3) == (0, None)
+
+
+@pytest.mark.parametrize('fen', [
+    '8/8/4k3/8/8/3NK3/8/8 w - - 0 1',
+    '8/8/4k3/8/8/3BK3/8/8 b - - 0 1',
+])
+def test_lone_minor_piece_is_a_draw(fen):
+    ai = chess50.ChessAI(table_mb=1)
+    value, _ = ai.search(chess.Board(fen), depth=4)
+
+    assert value == 0
+
+
+def test_repeating_a_game_position_is_a_draw():
+    ai = chess50.ChessAI(table_mb=1)
+
+    # A queen up, but Black's Ke8 repeats the position the game started from
+    board = chess.Board('4k3/8/8/8/8/8/8/Q3K3 w - - 0 1')
+    for move in ('e1d1', 'e8d8', 'd1e1'):
+        board.push_uci(move)
+    ai.start(board)
+    ai.push(board, chess.Move.from_uci('d8e8'))
+    assert ai.negamax(board, 2, -chess50.INFINITY, chess50.INFINITY) == 0
+
+    # The same position without the game before it is not a draw
+    board = chess.Board('3k4/8/8/8/8/8/8/Q3K3 b - - 3 2')
+    ai.start(board)
+    ai.push(board, chess.Move.from_uci('d8e8'))
+    assert ai.negamax(board, 2, -chess50.INFINITY, chess50.INFINITY) > 0
@@ -0,0 +1,355 @@
+"""
+Tune the chess AI's piece values and piece-square tables to the results of games
+"""
+import argparse
+import collections
+import concurrent.futures
+import io
+import json
+import math
+import os
+import time
+
+# niklasf/python-chess is licensed under GPL-3.0
+import chess
+import chess.pgn
+import numpy as np
+
+import chess50
+import pgnfile
+
+# Games read from the PGN files and sent to a worker process at a time
+GAMES_PER_TASK = 200
+
+# Opening moves of every game that are skipped, as they mostly come from books
+SKIP_PLIES = 8
+
+# Most pieces on a board, which is the width of the feature matrix
+MAX_PIECES = 32
+
+# Weights of the evaluation: one for each piece type on each square
+FEATURES = 6 * 64
+
+# Rows of the feature matrix evaluated at a time, which bounds the memory
+# used by each step of the descent
+CHUNK_SIZE = 1 << 18
+
+# Steps of gradient descent and their size in centipawns
+ITERATIONS = 500
+LEARNING_RATE = 1.0
+
+# Share of the positions held out to check the fit on
+VALIDATION = 0.1
+
+# Results of a game in half points for White
+RESULTS = {'1-0': 2, '1/2-1/2': 1, '0-1': 0}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('pgn', nargs='*', help="PGN files to read positions from")
+    parser.add_argument('--features', default='features.npz', help="file caching the positions read from the PGN files")
+    parser.add_argument('--rebuild', action='store_true', help="read the PGN files even if the features are cached")
+    parser.add_argument('--output', default='tables.json', help="file to write the tables to")
+    parser.add_argument('--iterations', type=int, default=ITERATIONS, help="steps of gradient descent")
+    parser.add_argument('--rate', type=float, default=LEARNING_RATE, help="learning rate in centipawns")
+    parser.add_argument('--validation', type=float, default=VALIDATION, help="share of positions held out")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes reading the PGN files")
+    args = parser.parse_args()
+
+    if os.path.exists(args.features) and not args.rebuild:
+        with np.load(args.features) as cache:
+            features, results = cache['features'], cache['results']
+        print(f"Loaded {len(results)} positions from {args.features}")
+    elif args.pgn:
+        started = time.monotonic()
+        features, results = extract(args.pgn, args.workers)
+        np.savez(args.features, features=features, results=results)
+        print(f"Saved {len(results)} positions to {args.features} in {time.monotonic() - started:.1f} s")
+    else:
+        parser.error("give PGN files to read or an existing features file")
+
+    # Hold out a random share of the positions
+    order = np.random.default_rng(0).permutation(len(results))
+    held_out = int(len(order) * args.validation)
+    train = Positions(features[order[held_out:]], results[order[held_out:]])
+    validation = Positions(features[order[:held_out]], results[order[:held_out]])
+
+    weights = initial_weights()
+    k = fit_scale(weights, train)
+    print(f"Scale {k:.3f}, error {train.error(weights, k):.6f} (validation {validation.error(weights, k):.6f})")
+
+    started = time.monotonic()
+    weights = descend(weights, train, k, args.iterations, args.rate)
+    print(
+        f"Error {train.error(weights, k):.6f} (validation {validation.error(weights, k):.6f}) "
+        f"after {args.iterations} iterations in {time.monotonic() - started:.1f} s"
+    )
+
+    value, piece_square = split_tables(weights, train.seen())
+    with open(args.output, 'w') as file:
+        json.dump({
+            'value': {chess.piece_symbol(piece_type): value[piece_type] for piece_type in chess.PIECE_TYPES},
+            'piece_square': {
+                chess.piece_symbol(piece_type): piece_square[piece_type] for piece_type in chess.PIECE_TYPES
+            },
+            'scale': k,
+            'positions': len(results),
+        }, file, indent=1)
+    print(f"Wrote the tables to {args.output}, which ChessAI(tables=...) loads")
+
+
+def extract(paths, workers):
+    """
+    Reads the quiet positions of the games in some PGN files in worker
+    processes, returning their feature matrix and the game results
+
+    Only a few batches of games are read ahead of the workers, so memory
+    does not grow with the size of the files
+    """
+    features = []
+    results = []
+    pending = collections.deque()
+
+    def collect(future):
+        rows, outcomes = future.result()
+        features.append(rows)
+        results.append(outcomes)
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for games in game_batches(paths):
+            pending.append(pool.submit(extract_positions, games))
+            if len(pending) >= workers * 2:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+
+    if not results:
+        return np.zeros((0, MAX_PIECES), dtype=np.int16), np.zeros(0, dtype=np.int8)
+    return np.concatenate(features), np.concatenate(results)
+
+
+def game_batches(paths):
+    """
+    Generates lists of GAMES_PER_TASK games from the PGN files as text
+    """
+    games = []
+
+    for text in pgnfile.read_games(paths):
+        games.append(text)
+        if len(games) == GAMES_PER_TASK:
+            yield games
+            games = []
+
+    if games:
+        yield games
+
+
+def extract_positions(games):
+    """
+    Returns the feature rows of the quiet positions in some games,
+    with the result of the game each was played in
+    """
+    rows = []
+    results = []
+
+    for text in games:
+        game = chess.pgn.read_game(io.StringIO(text))
+        result = RESULTS.get(game.headers.get('Result')) if game else None
+        if result is None:
+            continue
+
+        board = game.board()
+        captured = False
+        for ply, move in enumerate(game.mainline_moves()):
+
+            # Positions in the middle of an exchange or in check are left out,
+            # as their static value says little about the result
+            capture = board.is_capture(move)
+            if (
+                ply >= SKIP_PLIES and
+                not captured and not capture and not move.promotion and
+                not board.is_check() and
+                chess.popcount(board.occupied) <= MAX_PIECES
+            ):
+                rows.append(feature_row(board))
+                results.append(result)
+
+            captured = capture
+            board.push(move)
+
+    return (
+        np.array(rows, dtype=np.int16).reshape(-1, MAX_PIECES),
+        np.array(results, dtype=np.int8)
+    )
+
+
+def feature_row(board):
+    """
+    Encodes the pieces of a board as the indices of their weights plus one,
+    negative for Black's pieces, padded with zeros. Black's squares are
+    mirrored the way chess50.square_values mirrors them
+    """
+    row = [0] * MAX_PIECES
+    for i, (square, piece) in enumerate(board.piece_map().items()):
+        if piece.color == chess.WHITE:
+            row[i] = (piece.piece_type - 1) * 64 + square + 1
+        else:
+            row[i] = -((piece.piece_type - 1) * 64 + 63 - square + 1)
+
+    return row
+
+
+class Positions():
+    """
+    Feature matrix and results of a set of positions, split into sign and
+    weight index once so that evaluating them is a gather and a sum
+    """
+
+    def __init__(self, features, results):
+        self.indices = np.abs(features).astype(np.int32)
+        self.signs = np.sign(features).astype(np.int8)
+        self.results = results.astype(np.float32) / 2
+
+    def __len__(self):
+        return len(self.results)
+
+    def chunks(self):
+        """
+        Generates the indices, signs and results of CHUNK_SIZE positions at a time
+        """
+        for start in range(0, len(self), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            yield self.indices[start:end], self.signs[start:end], self.results[start:end]
+
+    def error(self, weights, k):
+        """
+        Returns the mean squared difference between the results and
+        the win probabilities the weights give the positions
+        """
+        if not len(self):
+            return 0.0
+
+        total = 0.0
+        for indices, signs, results in self.chunks():
+            total += float(((win_probability(evaluate(weights, indices, signs), k) - results) ** 2).sum())
+        return total / len(self)
+
+    def gradient(self, weights, k):
+        """
+        Returns the gradient of the error with respect to the weights
+        """
+        gradient = np.zeros(FEATURES + 1, dtype=np.float64)
+        for indices, signs, results in self.chunks():
+            probability = win_probability(evaluate(weights, indices, signs), k)
+            slope = 2 * (probability - results) * probability * (1 - probability) * k * math.log(10) / 400
+            gradient += np.bincount(
+                indices.ravel(),
+                weights=(signs * slope[:, None]).ravel(),
+                minlength=FEATURES + 1
+            )
+
+        gradient[0] = 0
+        return gradient / len(self)
+
+    def seen(self):
+        """
+        Returns whether each weight is used by any position
+        """
+        return np.bincount(self.indices.ravel(), minlength=FEATURES + 1) > 0
+
+
+def evaluate(weights, indices, signs):
+    """
+    Returns the value of positions from White's point of view,
+    the same way ChessAI.utility adds up SQUARE_VALUE
+    """
+    return (weights[indices] * signs).sum(axis=1)
+
+
+def win_probability(values, k):
+    """
+    Converts values to White's expected score with a logistic curve
+    """
+    return 1 / (1 + np.power(10, -k * values / 400))
+
+
+def initial_weights():
+    """
+    Returns the weights of chess50's current tables, with the padding
+    weight at index 0
+    """
+    weights = np.zeros(FEATURES + 1, dtype=np.float32)
+    for piece_type in chess.PIECE_TYPES:
+        for square in chess.SQUARES:
+            weights[(piece_type - 1) * 64 + square + 1] = chess50.SQUARE_VALUE[chess.WHITE][piece_type][square]
+
+    return weights
+
+
+def fit_scale(weights, positions):
+    """
+    Returns the scale of the logistic curve that best fits the current
+    weights to the results, searching coarsely and then finely
+    """
+    best = 1.0
+    for step in (0.1, 0.01):
+        candidates = np.arange(max(step, best - step * 10), best + step * 10, step)
+        best = min(candidates, key=lambda k: positions.error(weights, k))
+
+    return float(best)
+
+
+def descend(weights, positions, k, iterations, rate):
+    """
+    Fits the weights to the results with Adam gradient descent,
+    returning the fitted weights
+    """
+    weights = weights.astype(np.float64)
+    moment = np.zeros_like(weights)
+    variance = np.zeros_like(weights)
+    beta1, beta2 = 0.9, 0.999
+
+    for iteration in range(1, iterations + 1):
+        gradient = positions.gradient(weights, k)
+        moment = beta1 * moment + (1 - beta1) * gradient
+        variance = beta2 * variance + (1 - beta2) * gradient ** 2
+        step = moment / (1 - beta1 ** iteration) / (np.sqrt(variance / (1 - beta2 ** iteration)) + 1e-12)
+        weights -= rate * step
+
+        if not iteration % 50:
+            print(f"Iteration {iteration:>5}  error {positions.error(weights, k):.6f}", flush=True)
+
+    return weights
+
+
+def split_tables(weights, seen):
+    """
+    Splits the weights into piece values, the mean weight of each piece type
+    over the squares it was seen on, and piece-square tables of the rest,
+    keeping the king's value as the kings always cancel out and the current
+    piece-square values of squares no piece was seen on
+    """
+    value = {}
+    piece_square = {}
+
+    for piece_type in chess.PIECE_TYPES:
+        start = (piece_type - 1) * 64 + 1
+        table = weights[start:start + 64]
+        used = seen[start:start + 64]
+
+        if piece_type == chess.KING or not used.any():
+            value[piece_type] = chess50.VALUE[piece_type]
+        else:
+            value[piece_type] = int(round(table[used].mean()))
+        piece_square[piece_type] = [
+            int(round(weight - value[piece_type])) if used[square] else chess50.PIECE_SQUARE[piece_type][square]
+            for square, weight in enumerate(table)
+        ]
+
+    return value, piece_square
+
+
+if __name__ == '__main__':
+    main()
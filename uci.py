@@ -0,0 +1,170 @@
+"""
+Run the chess AI as an engine for the Universal Chess Interface (UCI)
+"""
+import sys
+import threading
+
+# niklasf/python-chess is licensed under GPL-3.0
+import chess
+
+import chess50
+
+NAME = 'chess50'
+AUTHOR = 'Jessan Rendell G. Belenzo'
+
+# Moves assumed to be left in the game when the time control does not say
+MOVES_TO_GO = 30
+
+# Milliseconds kept in reserve for communication with the GUI
+MOVE_OVERHEAD = 50
+
+
+def main():
+
+    ai = chess50.ChessAI()
+    board = chess.Board()
+
+    # Searches run in a thread so stop can be read while they think
+    search = None
+    halt = threading.Event()
+
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command, arguments = tokens[0], tokens[1:]
+
+        if command == 'uci':
+            send(f"id name {NAME}")
+            send(f"id author {AUTHOR}")
+            send("uciok")
+
+        elif command == 'isready':
+            send("readyok")
+
+        elif command == 'ucinewgame':
+            stop(search, halt)
+            ai.table.clear()
+            board = chess.Board()
+
+        elif command == 'position':
+            stop(search, halt)
+            board = parse_position(arguments)
+
+        elif command == 'go':
+            stop(search, halt)
+            halt.clear()
+            search = threading.Thread(
+                target=go,
+                args=(ai, board.copy(), parse_go(arguments, board.turn), halt),
+                daemon=True
+            )
+            search.start()
+
+        elif command == 'stop':
+            stop(search, halt)
+
+        elif command == 'quit':
+            stop(search, halt)
+            break
+
+
+def go(ai, board, limits, halt):
+    """
+    Searches the board and sends its progress and the best move
+    """
+    _, move = ai.search(
+        board,
+        stop=halt,
+        callback=lambda info: send_info(board, info),
+        **limits
+    )
+    send(f"bestmove {move.uci() if move else '0000'}")
+
+
+def stop(search, halt):
+    """
+    Stops a running search, which then sends its best move
+    """
+    if search and search.is_alive():
+        halt.set()
+        search.join()
+
+
+def parse_position(arguments):
+    """
+    Returns the board described by the arguments of a position command
+    """
+    board = chess.Board()
+
+    if arguments and arguments[0] == 'fen':
+        end = arguments.index('moves') if 'moves' in arguments else len(arguments)
+        board = chess.Board(' '.join(arguments[1:end]))
+        arguments = arguments[end:]
+    elif arguments and arguments[0] == 'startpos':
+        arguments = arguments[1:]
+
+    if arguments and arguments[0] == 'moves':
+        for move in arguments[1:]:
+            board.push_uci(move)
+
+    return board
+
+
+def parse_go(arguments, turn):
+    """
+    Returns the keyword arguments of ChessAI.search for a go command
+    """
+    options = {}
+    for name, value in zip(arguments, arguments[1:]):
+        if value.lstrip('-').isdigit():
+            options[name] = int(value)
+
+    limits = {}
+
+    if 'depth' in options:
+        limits['depth'] = max(1, options['depth'])
+
+    if 'movetime' in options:
+        limits['movetime'] = max(1, options['movetime'] - MOVE_OVERHEAD)
+
+    # Spend an even share of the remaining time plus most of the increment
+    elif 'infinite' not in arguments:
+        time_left = options.get('wtime' if turn == chess.WHITE else 'btime')
+        increment = options.get('winc' if turn == chess.WHITE else 'binc', 0)
+        if time_left is not None:
+            share = time_left / options.get('movestogo', MOVES_TO_GO) + increment * 3 / 4
+            limits['movetime'] = max(1, min(share, time_left / 2) - MOVE_OVERHEAD)
+
+    return limits
+
+
+def send_info(board, info):
+    """
+    Sends the progress of a search, with the score from the point of view
+    of the player to move, and no principal variation if there is no move
+    """
+    value = info['value'] if board.turn == chess.WHITE else -info['value']
+
+    mate = chess50.mate_in(board, value, info['pv'], info['depth'])
+    score = f"cp {value}" if mate is None else f"mate {mate}"
+
+    pv = info['pv'] or ([info['move']] if info['move'] else [])
+    send(
+        f"info depth {info['depth']} score {score} nodes {info['nodes']} "
+        f"nps {info['nps']} time {int(info['time'] * 1000)}" +
+        (f" pv {' '.join(move.uci() for move in pv)}" if pv else "")
+    )
+
+
+# Output from the search thread and the main thread must not interleave
+output_lock = threading.Lock()
+
+
+def send(message):
+    with output_lock:
+        print(message, flush=True)
+
+
+if __name__ == '__main__':
+    main()
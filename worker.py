@@ -0,0 +1,20 @@
+"""
+Set up the worker processes of the scripts that search positions in a pool
+"""
+import signal
+
+import chess50
+
+# ChessAI of a worker process, kept from one task to the next
+worker_ai = None
+
+
+def start_worker(buffer, table_mb, options):
+    """
+    Sets up a worker process's ChessAI on the shared transposition table,
+    leaving interrupts to the main process so that it can shut the
+    workers down itself
+    """
+    global worker_ai
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_ai = chess50.ChessAI(table_mb=table_mb, table_buffer=buffer, **options)